@@ -1,16 +1,35 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from threading import Event
+from collections import deque
 import threading
-import pyaudio
-from pydub import AudioSegment
+import logging
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import random
 import time
 
-from constants import BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH
-from GUI_config import create_controls, create_timeline
-from audio_config import adjust_volume, mix_audio_clips, create_waveform
+from constants import (
+    BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH, NUM_TRACKS,
+    METER_FLOOR_DB, METER_REFRESH_MS, METER_DECAY_DB, METER_HOLD_MS, METER_INTERVAL_BLOCKS,
+    RECORDINGS_DIR, WAVEFORM_PEAK_FRAMES, WAVEFORM_REFRESH_MS, PLAYBACK_BLOCK_FRAMES, STEM_BLOCK_SECONDS,
+    MEMORY_BUDGET_MB, PREFETCH_SECONDS, PREFETCH_START_SECONDS, PREFETCH_WAIT_SECONDS
+)
+from GUI_config import (
+    create_controls, create_timeline, create_meters, create_stem_progress, create_insert_editor, snap_to_grid
+)
+from audio_config import (
+    mix_audio_clips, create_waveform,
+    measure_levels, level_to_db, render_stem, CLIP_LEVEL
+)
+from recorder import Recorder
+from importer import ClipImporter, read_pcm_header
+from clip_cache import ClipCache
+from metronome import Metronome
+
+logger = logging.getLogger("DAW")
 
 class DAWApp:
     def __init__(self, root):
@@ -19,12 +38,34 @@ class DAWApp:
         self.root.geometry("1200x600")
         self.audio_clips = []
         self.current_audio = None
-        self.pyaudio_instance = pyaudio.PyAudio()
+        #opened in the background once the window is up, probing devices is slow
+        self.pyaudio_instance = None
+        self.audio_ready = Event()
+        self.audio_init_thread = None
         self.audio_stream = None
         self.is_playing = False
         self.pause_event = Event()
         self.playback_thread = None
         self.playback_stopped_manually = False 
+        self.playback_track_mix = None
+        self.master_volume_db = -20
+
+        #insert chains, effect instances are shared with the playback mixer so parameter changes are live
+        self.track_effects = [[] for _ in range(NUM_TRACKS)]
+        self.master_effects = []
+        self.stem_export_thread = None
+        self.stem_progress = {}
+
+        #latency compensation for recording, stream clock time at which the
+        #playhead frame is heard, set by the playback thread
+        self.playback_heard_at = None
+        self.recorder = None
+        self.record_waveform_ids = []
+
+        #imports in progress, and the cache that decides which clips stay in RAM
+        self.imports = []
+        self.clip_cache = ClipCache(MEMORY_BUDGET_MB * 1024 * 1024)
+        self.resident_mb_shown = None
 
         self.bpm = 120
         self.beats_per_bar = 4  
@@ -33,20 +74,74 @@ class DAWApp:
         self.pixels_per_second = 100  
         self.update_time_mapping()   
 
+        self.metronome = Metronome()
+        self.metronome.set_tempo(self.bpm, self.beats_per_bar, self.subdivision)
+        self.playback_metronome = None
+
         #playhead pos
         self.playhead_position = 0
         self.playback_start_position = 0
 
+        #level meters, one per track plus master
+        #the playback thread appends (peaks and sums of squares, samples) per metered block, the ui timer pops them all
+        self.meter_queue = deque(maxlen=256)
+        self.meter_rms = np.zeros(NUM_TRACKS + 1, dtype=np.float32)
+        self.meter_clipped = np.zeros(NUM_TRACKS + 1, dtype=bool)
+        self.meter_display = np.full(NUM_TRACKS + 1, METER_FLOOR_DB, dtype=np.float32)
+        self.meter_hold = np.full(NUM_TRACKS + 1, METER_FLOOR_DB, dtype=np.float32)
+        self.meter_hold_time = np.zeros(NUM_TRACKS + 1)
+
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.create_controls()
         self.create_timeline()
+        self.create_meters()
+        self.refresh_meters()
+
+        self.root.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        """Draw the grid and bring up the audio backend once the window is shown."""
+        self.root.update_idletasks()
+
+        start = time.perf_counter()
+        self.update_scroll_region()
+        logger.info("startup: draw timeline %.1f ms", (time.perf_counter() - start) * 1000)
+
+        self.audio_init_thread = threading.Thread(target=self._init_audio_backend, daemon=True)
+        self.audio_init_thread.start()
+
+    def _init_audio_backend(self):
+        start = time.perf_counter()
+        try:
+            import pyaudio
+            #warm the decoder and mixer imports so first use doesn't pay for them
+            import pydub  # noqa: F401
+            import mixer  # noqa: F401
+            logger.info("startup: import audio modules %.1f ms", (time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            self.pyaudio_instance = pyaudio.PyAudio()
+            logger.info("startup: open audio backend %.1f ms", (time.perf_counter() - start) * 1000)
+        except Exception:
+            logger.exception("startup: failed to open audio backend")
+        finally:
+            self.audio_ready.set()
 
     def on_close(self):
         #clean up when closed
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+        for pending in self.imports:
+            pending["importer"].cancel()
         self.stop_audio()
-        self.pyaudio_instance.terminate()
+        if self.audio_init_thread:
+            self.audio_init_thread.join(timeout=2)
+        if self.pyaudio_instance:
+            self.pyaudio_instance.terminate()
         self.root.destroy()
+        self.clip_cache.close()
 
     def create_controls(self):
         create_controls(self)
@@ -54,6 +149,57 @@ class DAWApp:
     def create_timeline(self):
         create_timeline(self)
 
+    def create_meters(self):
+        create_meters(self)
+
+    def refresh_meters(self):
+        """Apply peak hold and decay to the latest levels and redraw the meters."""
+        #popleft takes each block exactly once, nothing the playback thread appends meanwhile is lost
+        peaks = np.zeros(NUM_TRACKS + 1, dtype=np.float32)
+        while self.meter_queue:
+            levels, samples = self.meter_queue.popleft()
+            np.maximum(peaks, levels[0], out=peaks)
+            self.meter_rms = np.sqrt(levels[1] / samples)
+        self.meter_clipped |= peaks >= CLIP_LEVEL
+
+        peak_db = level_to_db(peaks)
+        rms_db = level_to_db(self.meter_rms)
+        self.meter_display = np.maximum(peak_db, self.meter_display - METER_DECAY_DB)
+
+        now = time.monotonic()
+        expired = (now - self.meter_hold_time) * 1000 > METER_HOLD_MS
+        new_hold = (peak_db >= self.meter_hold) | expired
+        self.meter_hold[new_hold] = peak_db[new_hold]
+        self.meter_hold_time[new_hold] = now
+
+        for index, meter in enumerate(self.meters):
+            self.draw_meter(meter, rms_db[index], self.meter_display[index], self.meter_hold[index], self.meter_clipped[index])
+
+        resident_mb = self.clip_cache.resident_bytes // (1024 * 1024)
+        if resident_mb != self.resident_mb_shown:
+            self.resident_mb_shown = resident_mb
+            self.memory_label.config(text=f"RAM: {resident_mb} MB")
+
+        self.root.after(METER_REFRESH_MS, self.refresh_meters)
+
+    def draw_meter(self, meter, rms_db, peak_db, hold_db, clipped):
+        canvas = meter["canvas"]
+        x0, y0, x1, y1 = meter["box"]
+        height = y1 - y0
+
+        def level_y(db):
+            return y1 - (db - METER_FLOOR_DB) / -METER_FLOOR_DB * height
+
+        canvas.coords(meter["rms_id"], x0, level_y(rms_db), x1, y1)
+        peak_y = level_y(peak_db)
+        canvas.coords(meter["peak_id"], x0, peak_y, x1, peak_y)
+        hold_y = level_y(hold_db)
+        canvas.coords(meter["hold_id"], x0, hold_y, x1, hold_y)
+        canvas.itemconfig(meter["clip_id"], fill="red" if clipped else "#505050")
+
+    def reset_clip_indicators(self, event=None):
+        self.meter_clipped[:] = False
+
     def xview(self, *args):
         #scroll views
         self.timeline_canvas.xview(*args)
@@ -142,24 +288,77 @@ class DAWApp:
 
     def import_audio(self):
         file_path = filedialog.askopenfilename(
-            filetypes=[("Audio Files", "*.wav *.mp3"), ("All files", "*.*")]
+            filetypes=[("Audio Files", "*.wav *.aif *.aiff *.mp3 *.flac *.ogg *.m4a"), ("All files", "*.*")]
         )
         if not file_path:
             return
 
-        try:
-            audio = AudioSegment.from_file(file_path)
+        #clips still importing take their slot too
+        clip_count = len(self.audio_clips) + len(self.imports)
+        track_num = clip_count % NUM_TRACKS + 1
+        x_position = 100 + clip_count * 100
 
-            raw_data = audio.raw_data
-            frame_rate = audio.frame_rate
-            channels = audio.channels
-            sample_width = audio.sample_width
+        store_path = self.clip_cache.new_store_path()
 
-            track_num = len(self.audio_clips) % 5 + 1
-            x_position = 100 + len(self.audio_clips) * 100
-            self.add_audio_clip(file_path, raw_data, frame_rate, channels, sample_width, track_num, x_position)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to import audio: {e}")
+        importer = ClipImporter(file_path, store_path)
+        importer.start()
+        self.imports.append({
+            "importer": importer,
+            "track": track_num,
+            "x": x_position,
+            "waveform_ids": [],
+            "peaks_drawn": 0,
+        })
+        if len(self.imports) == 1:
+            self.refresh_imports()
+
+    def refresh_imports(self):
+        """Draw the waveform of each import as it arrives and add the clip once decoding is done."""
+        for pending in list(self.imports):
+            importer = pending["importer"]
+            polygon_id, pending["peaks_drawn"] = self.draw_live_peaks(
+                importer.peaks, pending["peaks_drawn"], pending["x"], pending["track"], "#b8cdff"
+            )
+            if polygon_id:
+                pending["waveform_ids"].append(polygon_id)
+
+            if not importer.done:
+                continue
+
+            self.imports.remove(pending)
+            for item_id in pending["waveform_ids"]:
+                self.timeline_canvas.delete(item_id)
+            if importer.error:
+                messagebox.showerror("Error", f"Failed to import audio: {importer.error}")
+                continue
+
+            raw_data = importer.load()
+            if raw_data is None:
+                messagebox.showerror("Error", "Failed to import audio: file contains no audio")
+                continue
+            self.add_audio_clip(importer.file_path, raw_data, importer.peaks, pending["track"], pending["x"])
+
+        if self.imports:
+            self.root.after(WAVEFORM_REFRESH_MS, self.refresh_imports)
+
+    def draw_live_peaks(self, peaks, peaks_drawn, x_start, track_num, color):
+        """Draw peaks added since the last call as one polygon, returns its id (or None) and the new drawn count."""
+        count = len(peaks)
+        #start one peak back so the new segment joins the previous one
+        start = max(peaks_drawn - 1, 0)
+        if count - start <= 1:
+            return None, peaks_drawn
+
+        waveform_y = (track_num - 1) * 100 + 50
+        step = WAVEFORM_PEAK_FRAMES / BASE_SAMPLE_RATE * self.pixels_per_second
+        x_values = x_start + np.arange(start, count) * step
+        heights = np.array(peaks[start:count]) * 15
+        top = np.column_stack((x_values, waveform_y - heights)).ravel()
+        bottom = np.column_stack((x_values[::-1], waveform_y + heights[::-1])).ravel()
+        polygon_id = self.timeline_canvas.create_polygon(
+            np.concatenate((top, bottom)).tolist(), fill=color, outline=""
+        )
+        return polygon_id, count
 
     def get_random_color(self):
         colors = [
@@ -174,28 +373,12 @@ class DAWApp:
         ]
         return random.choice(colors)
 
-    def add_audio_clip(self, file_path, raw_data, frame_rate, channels, sample_width, track_num, x_position):
+    def add_audio_clip(self, file_path, raw_data, peaks, track_num, x_position):
+        """Add a clip in the base format, mapped from its store, with the peaks built while it streamed in."""
         waveform_y = (track_num - 1) * 100 + 50 
+        peaks = np.array(peaks, dtype=np.float32)
 
-        audio_segment = AudioSegment(
-            data=raw_data,
-            sample_width=sample_width,
-            frame_rate=frame_rate,
-            channels=channels
-        )
-
-        #set to base sample rate/channels
-        audio_segment = audio_segment.set_frame_rate(BASE_SAMPLE_RATE)
-        audio_segment = audio_segment.set_channels(BASE_CHANNELS)
-        audio_segment = audio_segment.set_sample_width(BASE_SAMPLE_WIDTH)
-
-        raw_data = audio_segment.raw_data
-        frame_rate = audio_segment.frame_rate
-        channels = audio_segment.channels
-        sample_width = audio_segment.sample_width
-
-        duration_ms = len(audio_segment)
-        duration_in_seconds = duration_ms / 1000
+        duration_in_seconds = len(raw_data) / (BASE_SAMPLE_RATE * BASE_CHANNELS * BASE_SAMPLE_WIDTH)
 
         clip_width = duration_in_seconds * self.pixels_per_second
 
@@ -224,25 +407,25 @@ class DAWApp:
             anchor="w", fill="black"
         )
 
-        waveform_points = create_waveform(raw_data, sample_width, waveform_y, x_position, clip_width)
+        waveform_points = create_waveform(peaks, waveform_y, x_position, clip_width)
         waveform_id = self.timeline_canvas.create_line(waveform_points, fill="black", smooth=True)
         waveform_ids = [waveform_id]
 
-        self.audio_clips.append({
+        clip = {
             "background_id": background_id,
             "outline_id": outline_id,
             "text_id": text_id,
             "waveform_ids": waveform_ids,
             "raw_data": raw_data,
-            "frame_rate": frame_rate,
-            "channels": channels,
-            "sample_width": sample_width,
+            "peaks": peaks,
             "x": x_position,
             "start_time_seconds": start_time_seconds,
             "track": track_num,
             "duration_seconds": duration_in_seconds,
             "clip_width": clip_width
-        })
+        }
+        self.audio_clips.append(clip)
+        self.clip_cache.add(clip)
 
         self.timeline_canvas.tag_raise(background_id)
         self.timeline_canvas.tag_raise(outline_id)
@@ -269,6 +452,10 @@ class DAWApp:
                 self.timeline_canvas.itemconfig(clip["outline_id"], outline="red", width=3)
                 break
 
+        #the start of the clip being edited stays in RAM, that is where it gets auditioned from
+        regions = [(self.selected_clip, 0, PREFETCH_SECONDS * BASE_SAMPLE_RATE)] if self.selected_clip else []
+        self.clip_cache.pin("selection", regions)
+
     def move_clip(self, event):
         if not self.selected_clip:
             return
@@ -317,11 +504,9 @@ class DAWApp:
         y = x_coords[1]
 
         #snap to track
-        subdivision_pixels = self.pixels_per_beat / self.subdivision
-        new_x = round(x / subdivision_pixels) * subdivision_pixels
+        new_x, new_track = snap_to_grid(x, y, self.pixels_per_beat, self.subdivision)
         dx = new_x - x
 
-        new_track = max(1, min(5, round(y / 100) + 1))
         new_y = (new_track - 1) * 100 + 50 - 15
         dy = new_y - y
 
@@ -365,8 +550,7 @@ class DAWApp:
             for line_id in clip["waveform_ids"]:
                 self.timeline_canvas.delete(line_id)
             waveform_points = create_waveform(
-                clip["raw_data"],
-                clip["sample_width"],
+                clip["peaks"],
                 waveform_y,
                 x_position,
                 clip_width
@@ -410,6 +594,9 @@ class DAWApp:
             self.pause_button.config(text="Pause")  
             self.play_button.config(text="Restart")  
             self.playback_start_position = self.playhead_position
+            self.playback_track_mix = self.get_track_mix()
+            self.playback_heard_at = None
+            self.playback_metronome = self.metronome if self.metronome_var.get() else None
             self.playback_thread = threading.Thread(target=self._play_clips)
             self.playback_thread.start()
         elif self.play_button['text'] == 'Restart':
@@ -439,83 +626,92 @@ class DAWApp:
         self.play_button.config(text="Play")
 
     def _play_clips(self):
-        total_duration_ms = self.get_total_duration()
-        combined_audio = mix_audio_clips(self.audio_clips, total_duration_ms)
+        self.audio_ready.wait()
+        if self.pyaudio_instance is None:
+            messagebox.showerror("Error", "Audio backend is not available")
+            self.is_playing = False
+            return
 
-        if combined_audio is None:
+        #with the click on an empty arrangement still plays, for recording the first take
+        if not self.audio_clips and not self.playback_metronome:
             self.is_playing = False
             return
 
-        start_time_ms = (self.playback_start_position / self.pixels_per_second) * 1000
+        from mixer import Mixer, to_pcm
+
+        sample_rate = BASE_SAMPLE_RATE
+        total_frames = int(self.get_total_duration() * sample_rate / 1000)
+        start_frame = int(self.playback_start_position / self.pixels_per_second * sample_rate)
 
-        if start_time_ms >= len(combined_audio):
+        if start_frame >= total_frames:
             messagebox.showinfo("Playback", "Playhead is out of bounds")
             self.is_playing = False
             return
 
-        combined_audio = combined_audio[start_time_ms:]
+        #blocks are mixed as they are played instead of rendering the whole arrangement up front
+        track_gains, track_mutes = self.playback_track_mix
+        mixer = Mixer(
+            self.audio_clips, track_gains, track_mutes, self.track_effects, self.master_effects,
+            PLAYBACK_BLOCK_FRAMES, self.playback_metronome
+        )
+        mixer.reset()
+        total_frames -= start_frame
+        total_frames_played = 0
+        meter_scratch = np.empty((NUM_TRACKS + 1, PLAYBACK_BLOCK_FRAMES * BASE_CHANNELS), dtype=np.float32)
+
+        #only the first few seconds are waited for, the rest of the window loads while playing
+        #a slow disk only costs the wait, the mixer reads whatever is not resident from the mapping
+        if not self.prefetch_clips(start_frame, PREFETCH_START_SECONDS).wait(PREFETCH_WAIT_SECONDS):
+            logger.warning("playback: first %ds not loaded after %ds, starting from disk", PREFETCH_START_SECONDS, PREFETCH_WAIT_SECONDS)
+        self.prefetch_clips(start_frame)
+        #re-pinned halfway through each window so the cache stays ahead
+        prefetch_frame = start_frame + PREFETCH_SECONDS * sample_rate // 2
+
+        #pre-roll the insert latency so the first block written is the one under the playhead
+        render_start = start_frame + mixer.latency
+        for position in range(start_frame, render_start, PLAYBACK_BLOCK_FRAMES):
+            mixer.render(position, min(PLAYBACK_BLOCK_FRAMES, render_start - position))
 
         try:
             self.audio_stream = self.pyaudio_instance.open(
-                format=self.pyaudio_instance.get_format_from_width(combined_audio.sample_width),
-                channels=combined_audio.channels,
-                rate=int(combined_audio.frame_rate),
+                format=self.pyaudio_instance.get_format_from_width(BASE_SAMPLE_WIDTH),
+                channels=BASE_CHANNELS,
+                rate=sample_rate,
                 output=True,
-                frames_per_buffer=1024
+                frames_per_buffer=PLAYBACK_BLOCK_FRAMES
             )
-            data = combined_audio.raw_data
-            sample_rate = combined_audio.frame_rate
-            channels = combined_audio.channels
-            sample_width = combined_audio.sample_width
-
-            chunk_frames = 1024  
-            chunk_size = chunk_frames * sample_width * channels 
-            total_frames_played = 0
-            total_frames = len(data) // (sample_width * channels)
+            output_latency = self.audio_stream.get_output_latency()
 
             while total_frames_played < total_frames and self.is_playing:
                 if self.pause_event.is_set():
                     while self.pause_event.is_set() and self.is_playing:
                         time.sleep(0.1)
-                start_byte = total_frames_played * sample_width * channels
-                end_byte = start_byte + chunk_size
-                chunk_data = data[start_byte:end_byte]
-                if not chunk_data:
-                    break
 
-                volume_db = self.volume_slider.get()
-                adjusted_chunk = adjust_volume(
-                    chunk_data,
-                    channels,
-                    sample_width,
-                    volume_db
-                )
+                frames_in_chunk = min(PLAYBACK_BLOCK_FRAMES, total_frames - total_frames_played)
+                master = mixer.render(render_start + total_frames_played, frames_in_chunk, self.master_volume_db)
+                adjusted_chunk = to_pcm(master)
+
+                #one block in METER_INTERVAL_BLOCKS is metered, every block would cost a large share of the render
+                if total_frames_played // PLAYBACK_BLOCK_FRAMES % METER_INTERVAL_BLOCKS == 0:
+                    self.meter_queue.append(measure_levels(mixer.buses[:, :frames_in_chunk], meter_scratch))
 
                 if self.audio_stream:
+                    if self.playback_heard_at is None:
+                        #the pre-roll already absorbed mixer.latency, this block starts at the playhead
+                        self.playback_heard_at = self.audio_stream.get_time() + output_latency
                     self.audio_stream.write(adjusted_chunk)
                 else:
                     break
 
-                frames_in_chunk = len(chunk_data) // (sample_width * channels)
                 total_frames_played += frames_in_chunk
+                if start_frame + total_frames_played >= prefetch_frame:
+                    self.prefetch_clips(start_frame + total_frames_played)
+                    prefetch_frame += PREFETCH_SECONDS * sample_rate // 2
 
                 elapsed_time = total_frames_played / sample_rate 
                 playhead_x = self.playback_start_position + (elapsed_time * self.pixels_per_second)
                 self.root.after(0, self.update_playhead_visual, playhead_x)
 
-            if self.is_playing:
-                remaining_data = data[total_frames_played * sample_width * channels:]
-                if remaining_data:
-                    volume_db = self.volume_slider.get()
-                    adjusted_chunk = adjust_volume(
-                        remaining_data,
-                        channels,
-                        sample_width,
-                        volume_db
-                    )
-                    if self.audio_stream:
-                        self.audio_stream.write(adjusted_chunk)
-
         except Exception as e:
             messagebox.showerror("Error", f"Playback error: {e}")
         finally:
@@ -524,6 +720,8 @@ class DAWApp:
                 self.root.after(0, self.update_playhead, final_playhead_x)
 
             self.is_playing = False
+            self.meter_queue.append((np.zeros((2, NUM_TRACKS + 1), dtype=np.float32), 1))
+            self.clip_cache.pin("playback", [])
             if self.audio_stream:
                 try:
                     self.audio_stream.stop_stream()
@@ -537,6 +735,111 @@ class DAWApp:
             self.playback_thread = None
             self.playback_stopped_manually = False  
 
+    def record_audio(self):
+        if self.recorder:
+            self.stop_recording()
+            return
+
+        if not self.audio_ready.is_set() or self.pyaudio_instance is None:
+            messagebox.showerror("Record", "Audio backend is not available")
+            return
+
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        file_path = os.path.join(RECORDINGS_DIR, time.strftime("take_%Y%m%d_%H%M%S.wav"))
+        recorder = Recorder(self.pyaudio_instance, file_path)
+        try:
+            recorder.start()
+        except Exception as e:
+            recorder.stop()
+            messagebox.showerror("Record", f"Failed to start recording: {e}")
+            return
+
+        self.recorder = recorder
+        self.record_track = int(self.record_track_var.get())
+        self.record_start_position = self.playhead_position
+        self.record_peaks_drawn = 0
+        self.record_button.config(text="Stop Rec", fg="red")
+
+        #play the arrangement along with the take
+        if self.play_button['text'] == 'Play':
+            self.play_audio()
+        else:
+            self.record_start_position = self.playback_start_position
+        self.refresh_recording()
+
+    def refresh_recording(self):
+        """Grow the live waveform from the peaks the writer has produced so far."""
+        if not self.recorder:
+            return
+
+        polygon_id, self.record_peaks_drawn = self.draw_live_peaks(
+            self.recorder.peaks, self.record_peaks_drawn, self.record_start_position, self.record_track, "#ff8787"
+        )
+        if polygon_id:
+            self.record_waveform_ids.append(polygon_id)
+
+        self.root.after(WAVEFORM_REFRESH_MS, self.refresh_recording)
+
+    def stop_recording(self):
+        recorder = self.recorder
+        self.recorder = None
+        recorder.stop()
+
+        self.record_button.config(text="Record", fg="black")
+        for item_id in self.record_waveform_ids:
+            self.timeline_canvas.delete(item_id)
+        self.record_waveform_ids = []
+        if self.is_playing:
+            self.stop_audio()
+
+        #both times are on the portaudio stream clock and include the device latencies
+        start_seconds = self.record_start_position / self.pixels_per_second
+        capture_start = recorder.capture_start_time()
+        if capture_start is not None and self.playback_heard_at is not None:
+            start_seconds += capture_start - self.playback_heard_at
+        start_frame = int(round(start_seconds * BASE_SAMPLE_RATE))
+
+        #map the take rather than reading it, it can be as long as the session
+        frame_bytes = BASE_CHANNELS * BASE_SAMPLE_WIDTH
+        try:
+            header = read_pcm_header(recorder.file_path)
+            skip = max(0, -start_frame)
+            frames = header["frames"] - skip if header else 0
+            raw_data = None
+            if frames > 0:
+                raw_data = np.memmap(
+                    recorder.file_path, dtype=np.uint8, mode="r",
+                    offset=header["offset"] + skip * frame_bytes, shape=(frames * frame_bytes,)
+                )
+        except Exception as e:
+            messagebox.showerror("Record", f"Failed to read recording: {e}")
+            return
+
+        if raw_data is None:
+            messagebox.showwarning("Record", "Nothing was recorded.")
+            return
+
+        x_position = max(start_frame, 0) / BASE_SAMPLE_RATE * self.pixels_per_second
+        self.add_audio_clip(
+            recorder.file_path, raw_data, recorder.peaks[skip // WAVEFORM_PEAK_FRAMES:], self.record_track, x_position
+        )
+
+    def prefetch_clips(self, frame, seconds=PREFETCH_SECONDS):
+        """Pin the part of every clip that plays in the next seconds, returns the event set once it is loaded."""
+        end_frame = frame + int(seconds * BASE_SAMPLE_RATE)
+        regions = []
+        for clip in self.audio_clips:
+            clip_start = int(round(clip["start_time_seconds"] * BASE_SAMPLE_RATE))
+            regions.append((clip, frame - clip_start, end_frame - clip_start))
+        return self.clip_cache.pin("playback", regions)
+
+    def update_memory_budget(self):
+        try:
+            budget_mb = int(self.memory_budget_var.get())
+        except ValueError:
+            return
+        self.clip_cache.set_budget(budget_mb * 1024 * 1024)
+
     def update_playhead_visual(self, playhead_x):
         """Update visual playhead position on the canvas."""
         self.timeline_canvas.coords(self.playhead, playhead_x, 0, playhead_x, 500)
@@ -570,15 +873,46 @@ class DAWApp:
         self.bpm = int(value)
         self.bpm_display.config(text=f"{self.bpm} BPM")
         self.update_time_mapping()
+        self.metronome.set_tempo(self.bpm, self.beats_per_bar, self.subdivision)
         self.update_clips_positions()
         self.update_scroll_region()
 
     def update_volume(self, value):
         volume_level = int(value)
-        print(f"Volume set to: {volume_level} dB")
+        self.master_volume_db = volume_level
+        logger.debug("volume set to %d dB", volume_level)
+
+    def get_track_mix(self):
+        #read on the ui thread, the render threads only get the snapshot
+        track_gains = [slider.get() for slider in self.track_gain_sliders]
+        track_mutes = [var.get() for var in self.track_mute_vars]
+        return track_gains, track_mutes
+
+    def copy_effects(self):
+        #offline renders get their own effect state so they can run alongside playback
+        track_effects = copy.deepcopy(self.track_effects)
+        master_effects = copy.deepcopy(self.master_effects)
+        for effect in master_effects + [effect for chain in track_effects for effect in chain]:
+            effect.reset()
+        return track_effects, master_effects
+
+    def open_insert_editor(self, track_num=None):
+        """Edit the insert chain of a track, or of the master when track_num is None."""
+        if track_num is None:
+            create_insert_editor(self, self.master_effects, "Master Inserts")
+        else:
+            create_insert_editor(self, self.track_effects[track_num - 1], f"Track {track_num} Inserts")
+
+    def add_insert(self, chain, effect_name):
+        from effects import EFFECT_TYPES
+        chain.append(EFFECT_TYPES[effect_name]())
+
+    def remove_insert(self, chain, effect):
+        chain.remove(effect)
 
     def update_division(self, value):
         self.subdivision = self.division_map[value] 
+        self.metronome.set_tempo(self.bpm, self.beats_per_bar, self.subdivision)
         self.update_scroll_region()
 
     def get_total_duration(self):
@@ -606,6 +940,7 @@ class DAWApp:
                 self.timeline_canvas.delete(line_id)
 
             self.audio_clips.remove(self.selected_clip)
+            self.clip_cache.remove(self.selected_clip)
             self.selected_clip = None
             self.update_scroll_region()
 
@@ -622,7 +957,15 @@ class DAWApp:
             return  
 
         total_duration_ms = self.get_total_duration()
-        combined_audio = mix_audio_clips(self.audio_clips, total_duration_ms)
+        track_gains, track_mutes = self.get_track_mix()
+        track_effects, master_effects = self.copy_effects()
+        #the click only goes into the export when asked for
+        metronome = None
+        if self.export_click_var.get():
+            metronome = self.metronome
+        combined_audio = mix_audio_clips(
+            self.audio_clips, total_duration_ms, track_gains, track_mutes, track_effects, master_effects, metronome
+        )
 
         if combined_audio is None:
             messagebox.showerror("Export", "Failed to mix audio clips.")
@@ -638,3 +981,77 @@ class DAWApp:
             messagebox.showinfo("Export", f"Arrangement exported successfully to {file_path}")
         except Exception as e:
             messagebox.showerror("Export", f"Failed to export arrangement: {e}")
+
+    def export_stems(self):
+        if not self.audio_clips:
+            messagebox.showwarning("Export", "No audio clips to export.")
+            return
+        if self.stem_export_thread and self.stem_export_thread.is_alive():
+            messagebox.showwarning("Export", "Stem export already in progress.")
+            return
+
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+
+        #every stem covers the same span so they line up when imported together
+        start_frame = min(int(round(clip["start_time_seconds"] * BASE_SAMPLE_RATE)) for clip in self.audio_clips)
+        end_frame = max(
+            int(round(clip["start_time_seconds"] * BASE_SAMPLE_RATE)) + len(clip["raw_data"]) // (BASE_CHANNELS * BASE_SAMPLE_WIDTH)
+            for clip in self.audio_clips
+        )
+
+        from mixer import Mixer
+
+        track_gains, track_mutes = self.get_track_mix()
+        track_effects, _ = self.copy_effects()
+        stems = []
+        for track_num in sorted({clip["track"] for clip in self.audio_clips}):
+            #a single bus mixer for this track, its latency is trimmed so stems stay aligned
+            stems.append({
+                "track": track_num,
+                "mixer": Mixer(
+                    self.audio_clips, track_gains, track_mutes, track_effects,
+                    block_frames=STEM_BLOCK_SECONDS * BASE_SAMPLE_RATE, track=track_num
+                ),
+                "file_path": os.path.join(directory, f"track_{track_num}.wav"),
+            })
+
+        self.stem_progress = {stem["track"]: 0.0 for stem in stems}
+        create_stem_progress(self, [stem["track"] for stem in stems])
+
+        self.stem_export_thread = threading.Thread(
+            target=self._export_stems, args=(stems, start_frame, end_frame - start_frame), daemon=True
+        )
+        self.stem_export_thread.start()
+        self.refresh_stem_progress()
+
+    def _export_stems(self, stems, start_frame, num_frames):
+        def render(stem):
+            def progress(fraction):
+                self.stem_progress[stem["track"]] = fraction
+            render_stem(stem["mixer"], start_frame, num_frames, stem["file_path"], progress)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(len(stems), os.cpu_count() or 1)) as executor:
+            futures = [(stem, executor.submit(render, stem)) for stem in stems]
+            for stem, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(f"Track {stem['track']}: {e}")
+
+        self.root.after(0, self.finish_stem_export, errors, os.path.dirname(stems[0]["file_path"]))
+
+    def refresh_stem_progress(self):
+        for track_num, bar in self.stem_progress_bars.items():
+            bar["value"] = self.stem_progress.get(track_num, 0) * 100
+        if self.stem_export_thread and self.stem_export_thread.is_alive():
+            self.root.after(100, self.refresh_stem_progress)
+
+    def finish_stem_export(self, errors, directory):
+        self.stem_progress_window.destroy()
+        if errors:
+            messagebox.showerror("Export", "Failed to export stems:\n" + "\n".join(errors))
+        else:
+            messagebox.showinfo("Export", f"Stems exported successfully to {directory}")
@@ -1,9 +1,15 @@
 import tkinter as tk
+from tkinter import ttk
+from constants import NUM_TRACKS, MEMORY_BUDGET_MB
 
 def create_controls(app):
     control_frame = tk.Frame(app.root, bg="lightgrey", height=60)
     control_frame.pack(fill=tk.X)
 
+    #recording, click, inserts, stems and memory get a second row so neither overflows the window
+    tools_frame = tk.Frame(app.root, bg="lightgrey")
+    tools_frame.pack(fill=tk.X)
+
     #play Button
     app.play_button = tk.Button(control_frame, text="Play", command=app.play_audio, width=10)
     app.play_button.pack(side=tk.LEFT, padx=10)
@@ -26,6 +32,26 @@ def create_controls(app):
     app.bpm_display = tk.Label(control_frame, text=f"{app.bpm} BPM", bg="lightgrey", font=("Arial", 12))
     app.bpm_display.pack(side=tk.LEFT, padx=10)
 
+    #record Button
+    app.record_button = tk.Button(tools_frame, text="Record", command=app.record_audio, width=10)
+    app.record_button.pack(side=tk.LEFT, padx=10)
+
+    #record track Selector
+    app.record_track_var = tk.StringVar()
+    app.record_track_var.set("1")
+    record_track_menu = tk.OptionMenu(tools_frame, app.record_track_var, *[str(n) for n in range(1, NUM_TRACKS + 1)])
+    record_track_menu.config(width=2)
+    record_track_menu.pack(side=tk.LEFT)
+
+    #metronome
+    app.metronome_var = tk.BooleanVar(value=False)
+    metronome_button = tk.Checkbutton(tools_frame, text="Click", variable=app.metronome_var, bg="lightgrey")
+    metronome_button.pack(side=tk.LEFT, padx=5)
+
+    app.export_click_var = tk.BooleanVar(value=False)
+    export_click_button = tk.Checkbutton(tools_frame, text="Click in Export", variable=app.export_click_var, bg="lightgrey")
+    export_click_button.pack(side=tk.LEFT, padx=5)
+
     #volume Slider
     volume_label = tk.Label(control_frame, text="Volume:", bg="lightgrey", font=("Arial", 12))
     volume_label.pack(side=tk.LEFT, padx=10)
@@ -36,6 +62,15 @@ def create_controls(app):
     app.volume_slider.set(-20)  
     app.volume_slider.pack(side=tk.LEFT, padx=10)
 
+    #master meter
+    app.master_meter_canvas = tk.Canvas(control_frame, width=24, height=50, bg="black", highlightthickness=0)
+    app.master_meter_canvas.pack(side=tk.LEFT, padx=10)
+    app.master_meter_canvas.bind("<Button-1>", app.reset_clip_indicators)
+
+    #master inserts Button
+    master_fx_button = tk.Button(tools_frame, text="Master FX", command=app.open_insert_editor)
+    master_fx_button.pack(side=tk.LEFT, padx=10)
+
     #division Selector
     division_label = tk.Label(control_frame, text="Grid Division:", bg="lightgrey", font=("Arial", 12))
     division_label.pack(side=tk.LEFT, padx=10)
@@ -56,6 +91,26 @@ def create_controls(app):
     export_button = tk.Button(control_frame, text="Export Arrangement", command=app.export_audio)
     export_button.pack(side=tk.LEFT, padx=10)
 
+    #stems Button
+    stems_button = tk.Button(tools_frame, text="Export Stems", command=app.export_stems)
+    stems_button.pack(side=tk.LEFT, padx=10)
+
+    #memory budget
+    app.memory_label = tk.Label(tools_frame, text="RAM: 0 MB", bg="lightgrey", font=("Arial", 12))
+    app.memory_label.pack(side=tk.LEFT, padx=10)
+
+    budget_label = tk.Label(tools_frame, text="Budget (MB):", bg="lightgrey", font=("Arial", 12))
+    budget_label.pack(side=tk.LEFT)
+
+    app.memory_budget_var = tk.StringVar()
+    app.memory_budget_var.set(str(MEMORY_BUDGET_MB))
+    budget_box = tk.Spinbox(
+        tools_frame, from_=128, to=65536, increment=128, width=6,
+        textvariable=app.memory_budget_var, command=app.update_memory_budget
+    )
+    budget_box.bind("<Return>", lambda event: app.update_memory_budget())
+    budget_box.pack(side=tk.LEFT, padx=5)
+
 def create_timeline(app):
     timeline_frame = tk.Frame(app.root, bg="white")
     timeline_frame.pack(fill=tk.BOTH, expand=True)
@@ -67,9 +122,37 @@ def create_timeline(app):
     tracks_frame = tk.Frame(main_frame, width=100, bg="lightgrey")
     tracks_frame.pack(side=tk.LEFT, fill=tk.Y)
 
-    for track_num in range(1, 6):
+    app.track_mute_vars = []
+    app.track_gain_sliders = []
+    for track_num in range(1, NUM_TRACKS + 1):
+        track_y = (track_num - 1) * 100
         track_label = tk.Label(tracks_frame, text=f"Track {track_num}", bg="lightgrey", width=12, anchor="w")
-        track_label.place(x=0, y=(track_num - 1) * 100, height=100)
+        track_label.place(x=0, y=track_y, height=25)
+
+        #mute and gain
+        mute_var = tk.BooleanVar(value=False)
+        mute_button = tk.Checkbutton(tracks_frame, text="Mute", variable=mute_var, bg="lightgrey")
+        mute_button.place(x=0, y=track_y + 25)
+        app.track_mute_vars.append(mute_var)
+
+        fx_button = tk.Button(
+            tracks_frame, text="FX", font=("Arial", 7), padx=2, pady=0,
+            command=lambda track_num=track_num: app.open_insert_editor(track_num)
+        )
+        fx_button.place(x=62, y=track_y + 27)
+
+        gain_slider = tk.Scale(
+            tracks_frame, from_=-50, to=5, orient=tk.HORIZONTAL, length=90, width=8,
+            bg="lightgrey", font=("Arial", 7), highlightthickness=0
+        )
+        gain_slider.set(0)
+        gain_slider.place(x=0, y=track_y + 50)
+        app.track_gain_sliders.append(gain_slider)
+
+    #track meters
+    app.track_meter_canvas = tk.Canvas(main_frame, width=24, bg="lightgrey", highlightthickness=0)
+    app.track_meter_canvas.pack(side=tk.LEFT, fill=tk.Y)
+    app.track_meter_canvas.bind("<Button-1>", app.reset_clip_indicators)
 
     canvas_frame = tk.Frame(main_frame)
     canvas_frame.pack(fill=tk.BOTH, expand=True, side=tk.RIGHT)
@@ -102,9 +185,7 @@ def create_timeline(app):
     app.playhead = app.timeline_canvas.create_line(0, 0, 0, 500, fill="red", width=2)
     app.ruler_playhead = app.ruler_canvas.create_line(0, 0, 0, 30, fill="red", width=2)
 
-    #grid
-    app.draw_ruler()
-    app.draw_grid()
+    #grid is drawn by finish_startup once the window is shown
 
     app.ruler_canvas.bind("<Button-1>", app.move_playhead_click)
     app.ruler_canvas.bind("<B1-Motion>", app.move_playhead_drag)
@@ -115,3 +196,93 @@ def create_timeline(app):
     app.timeline_canvas.bind("<ButtonRelease-1>", app.snap_clip)
 
     app.root.bind("<BackSpace>", app.delete_selected_clip)
+
+def create_meters(app):
+    app.meters = []
+    for track_num in range(1, NUM_TRACKS + 1):
+        y0 = (track_num - 1) * 100 + 10
+        app.meters.append(create_meter(app.track_meter_canvas, 6, y0, 18, y0 + 80))
+    app.meters.append(create_meter(app.master_meter_canvas, 6, 2, 18, 48))
+
+def create_meter(canvas, x0, y0, x1, y1):
+    #items are created once, refreshing only moves their coords
+    canvas.create_rectangle(x0, y0, x1, y1, fill="#202020", outline="")
+    meter = {
+        "canvas": canvas,
+        "box": (x0, y0 + 4, x1, y1),
+        "rms_id": canvas.create_rectangle(x0, y1, x1, y1, fill="#3cb043", outline=""),
+        "peak_id": canvas.create_line(x0, y1, x1, y1, fill="#ffeab8", width=2),
+        "hold_id": canvas.create_line(x0, y1, x1, y1, fill="white", width=1),
+        "clip_id": canvas.create_rectangle(x0, y0, x1, y0 + 3, fill="#505050", outline=""),
+    }
+    return meter
+
+def create_stem_progress(app, track_nums):
+    app.stem_progress_window = tk.Toplevel(app.root)
+    app.stem_progress_window.title("Exporting Stems")
+    app.stem_progress_window.transient(app.root)
+    #the export can't be cancelled, the window closes itself when it is done
+    app.stem_progress_window.protocol("WM_DELETE_WINDOW", lambda: None)
+
+    app.stem_progress_bars = {}
+    for row, track_num in enumerate(track_nums):
+        label = tk.Label(app.stem_progress_window, text=f"Track {track_num}", anchor="w")
+        label.grid(row=row, column=0, padx=10, pady=5, sticky="w")
+        bar = ttk.Progressbar(app.stem_progress_window, length=250, maximum=100)
+        bar.grid(row=row, column=1, padx=10, pady=5)
+        app.stem_progress_bars[track_num] = bar
+
+def create_insert_editor(app, chain, title):
+    from effects import EFFECT_TYPES
+
+    window = tk.Toplevel(app.root)
+    window.title(title)
+    window.transient(app.root)
+
+    add_frame = tk.Frame(window)
+    add_frame.pack(fill=tk.X, padx=10, pady=5)
+    effect_var = tk.StringVar()
+    effect_var.set(next(iter(EFFECT_TYPES)))
+    effect_menu = tk.OptionMenu(add_frame, effect_var, *EFFECT_TYPES)
+    effect_menu.config(width=10)
+    effect_menu.pack(side=tk.LEFT)
+
+    inserts_frame = tk.Frame(window)
+    inserts_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+    def rebuild():
+        for child in inserts_frame.winfo_children():
+            child.destroy()
+
+        for effect in chain:
+            effect_frame = tk.LabelFrame(inserts_frame, text=effect.NAME)
+            effect_frame.pack(fill=tk.X, pady=3)
+
+            for name, low, high, resolution, default in effect.PARAMS:
+                slider = tk.Scale(
+                    effect_frame, label=name, from_=low, to=high, resolution=resolution,
+                    orient=tk.HORIZONTAL, length=150,
+                    command=lambda value, effect=effect, name=name: effect.set_param(name, value)
+                )
+                slider.set(getattr(effect, name))
+                slider.pack(side=tk.LEFT, padx=3)
+
+            remove_button = tk.Button(
+                effect_frame, text="Remove",
+                command=lambda effect=effect: (app.remove_insert(chain, effect), rebuild())
+            )
+            remove_button.pack(side=tk.RIGHT, padx=5)
+
+    add_button = tk.Button(add_frame, text="Add Insert", command=lambda: (app.add_insert(chain, effect_var.get()), rebuild()))
+    add_button.pack(side=tk.LEFT, padx=10)
+
+    tk.Label(add_frame, text="Adding or removing inserts applies from the next playback").pack(side=tk.LEFT)
+
+    rebuild()
+
+def snap_to_grid(x, y, pixels_per_beat, subdivision):
+    #nearest subdivision line and the track under the clip's top edge
+    subdivision_pixels = pixels_per_beat / subdivision
+    new_x = round(x / subdivision_pixels) * subdivision_pixels
+    new_track = max(1, min(NUM_TRACKS, round(y / 100) + 1))
+    return new_x, new_track
@@ -1,83 +1,111 @@
+import wave
 import numpy as np
-from pydub import AudioSegment
-from constants import BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH
+from constants import (
+    BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH, FULL_SCALE,
+    METER_FLOOR_DB, STEM_BLOCK_SECONDS, WAVEFORM_PEAK_FRAMES
+)
 
-def adjust_volume(chunk_data, channels, sample_width, volume_db):
-    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[sample_width]
-    audio_array = np.frombuffer(chunk_data, dtype=dtype)
+CLIP_LEVEL = 32767 / FULL_SCALE
 
-    #stero or mono
-    if channels == 2:
-        audio_array = np.reshape(audio_array, (-1, 2))
-
-    volume_factor = 10 ** (volume_db / 20)
-
-    #adjust volume
-    adjusted_array = (audio_array * volume_factor).astype(dtype)
-
-    max_value = np.iinfo(dtype).max
-    min_value = np.iinfo(dtype).min
-    adjusted_array = np.clip(adjusted_array, min_value, max_value)
-
-    if channels == 2:
-        adjusted_array = adjusted_array.flatten()
-
-    adjusted_chunk = adjusted_array.tobytes()
-    return adjusted_chunk
-
-def mix_audio_clips(audio_clips, total_duration_ms):
+def mix_audio_clips(audio_clips, total_duration_ms, track_gains=None, track_mutes=None, track_effects=None, master_effects=None,
+                    metronome=None):
     if not audio_clips:
         return None
 
-    combined_audio = AudioSegment.silent(
-        duration=total_duration_ms,
-        frame_rate=BASE_SAMPLE_RATE
-    )
-    #set channels and sample width
-    combined_audio = combined_audio.set_channels(BASE_CHANNELS)
-    combined_audio = combined_audio.set_sample_width(BASE_SAMPLE_WIDTH)
-
-    for clip in audio_clips:
-        start_time_ms = clip["start_time_seconds"] * 1000
+    from pydub import AudioSegment
 
-        audio_segment = AudioSegment(
-            data=clip["raw_data"],
-            sample_width=clip["sample_width"],
-            frame_rate=clip["frame_rate"],
-            channels=clip["channels"]
-        )
+    data = render_mix(audio_clips, total_duration_ms, track_gains, track_mutes, track_effects, master_effects, metronome)
 
-        if audio_segment.frame_rate != BASE_SAMPLE_RATE:
-            audio_segment = audio_segment.set_frame_rate(BASE_SAMPLE_RATE)
-        if audio_segment.channels != BASE_CHANNELS:
-            audio_segment = audio_segment.set_channels(BASE_CHANNELS)
-        if audio_segment.sample_width != BASE_SAMPLE_WIDTH:
-            audio_segment = audio_segment.set_sample_width(BASE_SAMPLE_WIDTH)
+    return AudioSegment(
+        data=data,
+        sample_width=BASE_SAMPLE_WIDTH,
+        frame_rate=BASE_SAMPLE_RATE,
+        channels=BASE_CHANNELS
+    )
 
-        combined_audio = combined_audio.overlay(audio_segment, position=start_time_ms)
+def render_mix(audio_clips, total_duration_ms, track_gains=None, track_mutes=None, track_effects=None, master_effects=None,
+               metronome=None):
+    #int16 bytes of the arrangement from frame 0, everything of the export but the AudioSegment
+    from mixer import Mixer
 
-    return combined_audio
+    mixer = Mixer(
+        audio_clips, track_gains, track_mutes, track_effects, master_effects,
+        block_frames=STEM_BLOCK_SECONDS * BASE_SAMPLE_RATE, metronome=metronome
+    )
+    num_frames = int(total_duration_ms * BASE_SAMPLE_RATE / 1000)
+    return b"".join(mixer.render_pcm(0, num_frames))
 
-def create_waveform(raw_data, sample_width, y_offset, x_offset, clip_width, max_points=2000):
-    audio_array = np.frombuffer(raw_data, dtype=np.int16)
+def create_waveform(peaks, y_offset, x_offset, clip_width, max_points=2000):
+    #drawn from the clip's WAVEFORM_PEAK_FRAMES peaks, the audio itself can be memory mapped and hours long
     max_height = 20
+    if len(peaks) == 0:
+        peaks = np.zeros(1, dtype=np.float32)
 
-    num_points = min(int(clip_width), max_points)
-    if num_points <= 1:
-        num_points = 2 
-
-    indices = np.linspace(0, len(audio_array) - 1, num=num_points, dtype=int)
-    sampled_audio = audio_array[indices]
+    num_points = max(min(int(clip_width), max_points, len(peaks)), 2)
+    starts = np.linspace(0, len(peaks), num=num_points, endpoint=False).astype(int)
+    sampled_peaks = np.maximum.reduceat(peaks, starts)
 
-    max_value = np.max(np.abs(audio_array))
+    max_value = sampled_peaks.max()
     if max_value == 0:
         max_value = 1 
 
+    #alternate above and below the centre line so the envelope reads as a waveform
+    signs = np.where(np.arange(num_points) % 2, -1, 1)
     x_values = np.linspace(x_offset, x_offset + clip_width, num=num_points)
-    y_values = y_offset - (sampled_audio / max_value) * max_height
+    y_values = y_offset - (sampled_peaks / max_value) * signs * max_height
 
     points = []
     for x, y in zip(x_values, y_values):
         points.extend([x, y])
 
     return points 
+
+def add_source(block, block_start, start_frame, frames):
+    #add the part of a clip that overlaps the block
+    begin = max(block_start, start_frame)
+    end = min(block_start + len(block), start_frame + len(frames))
+    if begin < end:
+        block[begin - block_start:end - block_start] += frames[begin - start_frame:end - start_frame]
+
+def measure_levels(buses, scratch):
+    #peaks and sums of squares of every bus of a float block, scratch holds the magnitudes
+    #returned with the sample count, the ui does the rms so this stays three numpy calls
+    num_buses = buses.shape[0]
+    flat = buses.reshape(num_buses, -1)
+    levels = np.empty((2, num_buses), dtype=np.float32)
+    np.abs(flat, out=scratch[:, :flat.shape[1]]).max(axis=1, out=levels[0], initial=0)
+    np.matmul(flat[:, np.newaxis, :], flat[:, :, np.newaxis], out=levels[1].reshape(num_buses, 1, 1))
+    return levels, max(flat.shape[1], 1)
+
+class PeakBuilder:
+    """Normalised peaks per WAVEFORM_PEAK_FRAMES, built incrementally for live waveforms."""
+
+    def __init__(self):
+        self.peaks = []
+        self.carry = np.zeros((0, BASE_CHANNELS), dtype=np.int16)
+
+    def add(self, frames):
+        frames = np.concatenate((self.carry, frames))
+        blocks = len(frames) // WAVEFORM_PEAK_FRAMES
+        if blocks:
+            whole = frames[:blocks * WAVEFORM_PEAK_FRAMES].reshape(blocks, -1)
+            peaks = np.maximum(whole.max(axis=1), -whole.min(axis=1).astype(np.int32)) / FULL_SCALE
+            self.peaks.extend(peaks.tolist())
+        self.carry = frames[blocks * WAVEFORM_PEAK_FRAMES:].copy()
+
+def level_to_db(level):
+    return np.maximum(20 * np.log10(np.maximum(level, 1e-9)), METER_FLOOR_DB)
+
+def render_stem(mixer, start_frame, num_frames, file_path, progress=None):
+    #stream one track to a wav file block by block so memory stays bounded
+    with wave.open(file_path, "wb") as wav_file:
+        wav_file.setnchannels(BASE_CHANNELS)
+        wav_file.setsampwidth(BASE_SAMPLE_WIDTH)
+        wav_file.setframerate(BASE_SAMPLE_RATE)
+
+        written = 0
+        for pcm in mixer.render_pcm(start_frame, num_frames):
+            wav_file.writeframes(pcm)
+            written += len(pcm) // (BASE_CHANNELS * BASE_SAMPLE_WIDTH)
+            if progress:
+                progress(written / num_frames)
@@ -0,0 +1,187 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import itertools
+import logging
+from collections import OrderedDict
+import numpy as np
+
+from constants import BASE_CHANNELS, BASE_SAMPLE_WIDTH
+
+logger = logging.getLogger("DAW")
+
+#playback loads jump ahead of everything else in the queue
+PIN_PRIORITIES = {"playback": 0}
+
+def store_frames(clip):
+    return np.frombuffer(clip["raw_data"], dtype=np.int16).reshape(-1, BASE_CHANNELS)
+
+class ClipCache:
+    """Keeps regions of clip samples in RAM within a budget, the rest is read from each clip's disk store.
+
+    Every clip's "raw_data" is a memory mapped store on disk. A pin asks for a
+    frame range of a clip, the one ahead of the playhead or the start of the
+    selected clip, and a worker thread copies it into RAM as
+    clip["region"] = (first_frame, frames). Readers use the region when it
+    covers what they need and fall back to the mapping otherwise, so the
+    playback thread only ever reads a reference. Pinned regions are never
+    spilled, the rest are dropped least recently used first over the budget.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        self.clips = {}
+        self.pins = {}
+        self.lock = threading.Lock()
+        self.store_dir = None
+        self.store_count = 0
+
+        self.requests = queue.PriorityQueue()
+        self.request_order = itertools.count()
+        self.worker = threading.Thread(target=self._load_requests, daemon=True)
+        self.worker.start()
+
+    def new_store_path(self):
+        if not self.store_dir:
+            self.store_dir = tempfile.mkdtemp(prefix="daw_clips_")
+        self.store_count += 1
+        return os.path.join(self.store_dir, f"clip_{self.store_count}.pcm")
+
+    def add(self, clip):
+        raw_data = clip["raw_data"]
+        if isinstance(raw_data, np.memmap):
+            with self.lock:
+                self.clips[id(clip)] = clip
+            return
+
+        #in-memory data gets written out first, it stays resident until it is spilled
+        store_path = self.new_store_path()
+        with open(store_path, "wb") as store:
+            store.write(raw_data)
+        frames = np.frombuffer(raw_data, dtype=np.int16).reshape(-1, BASE_CHANNELS)
+        clip["raw_data"] = np.memmap(store_path, dtype=np.uint8, mode="r")
+        clip["region"] = (0, frames)
+        with self.lock:
+            self.clips[id(clip)] = clip
+            self.resident[id(clip)] = clip
+            self.resident_bytes += frames.nbytes
+        self._enforce_budget()
+
+    def remove(self, clip):
+        with self.lock:
+            self.clips.pop(id(clip), None)
+            if self.resident.pop(id(clip), None) is not None:
+                self.resident_bytes -= clip["region"][1].nbytes
+            for pinned in self.pins.values():
+                pinned.pop(id(clip), None)
+
+    def pin(self, group, regions):
+        """Replace the regions pinned under group, (clip, first_frame, end_frame) each.
+
+        Returns an event that is set once they are all resident.
+        """
+        priority = PIN_PRIORITIES.get(group, 1)
+        pinned = {}
+        loads = []
+        with self.lock:
+            #a clip holds one region, a more urgent pin keeps the one it asked for
+            urgent = self._urgent_pins(priority)
+            for clip, first_frame, end_frame in regions:
+                frames = len(clip["raw_data"]) // (BASE_CHANNELS * BASE_SAMPLE_WIDTH)
+                first_frame, end_frame = max(first_frame, 0), min(end_frame, frames)
+                if first_frame >= end_frame:
+                    continue
+                pinned[id(clip)] = (first_frame, end_frame)
+                if self._covers(clip, first_frame, end_frame):
+                    self.resident.move_to_end(id(clip))
+                elif id(clip) not in urgent:
+                    loads.append((clip, first_frame, end_frame))
+            self.pins[group] = pinned
+
+        for clip, first_frame, end_frame in loads:
+            self.requests.put((priority, next(self.request_order), clip, first_frame, end_frame))
+        #queued behind this pin's loads but ahead of anything less urgent
+        loaded = threading.Event()
+        self.requests.put((priority, next(self.request_order), loaded, 0, 0))
+        self._enforce_budget()
+        return loaded
+
+    def set_budget(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._enforce_budget()
+
+    def close(self):
+        self.requests.put((-1, next(self.request_order), None, 0, 0))
+        if self.store_dir:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def _covers(self, clip, first_frame, end_frame):
+        region = clip.get("region")
+        return region is not None and region[0] <= first_frame and end_frame <= region[0] + len(region[1])
+
+    def _urgent_pins(self, priority):
+        return set().union(*(
+            clips for group, clips in self.pins.items() if PIN_PRIORITIES.get(group, 1) < priority
+        ))
+
+    def _load_requests(self):
+        while True:
+            priority, _, clip, first_frame, end_frame = self.requests.get()
+            if clip is None:
+                return
+            if isinstance(clip, threading.Event):
+                clip.set()
+                continue
+            #a failed load leaves the clip on its disk mapping, the worker has to outlive it
+            try:
+                self._load(clip, first_frame, end_frame, priority)
+            except Exception:
+                logger.exception("clip cache: failed to load frames %d-%d", first_frame, end_frame)
+
+    def _load(self, clip, first_frame, end_frame, priority):
+        with self.lock:
+            if id(clip) not in self.clips or self._covers(clip, first_frame, end_frame):
+                return
+            if id(clip) in self._urgent_pins(priority):
+                return
+            old_first, old_frames = clip.get("region") or (0, None)
+
+        #read outside the lock, this is the part that touches the disk
+        #the part already resident is copied over, only the rest is read
+        frames = store_frames(clip)
+        data = np.empty((end_frame - first_frame, BASE_CHANNELS), dtype=np.int16)
+        overlap_first = max(first_frame, old_first)
+        overlap_end = min(end_frame, old_first + len(old_frames)) if old_frames is not None else overlap_first
+        if overlap_first < overlap_end:
+            data[:overlap_first - first_frame] = frames[first_frame:overlap_first]
+            data[overlap_first - first_frame:overlap_end - first_frame] = old_frames[overlap_first - old_first:overlap_end - old_first]
+            data[overlap_end - first_frame:] = frames[overlap_end:end_frame]
+        else:
+            data[:] = frames[first_frame:end_frame]
+
+        with self.lock:
+            if id(clip) not in self.clips:
+                return
+            if self.resident.pop(id(clip), None) is not None:
+                self.resident_bytes -= clip["region"][1].nbytes
+            clip["region"] = (first_frame, data)
+            self.resident[id(clip)] = clip
+            self.resident_bytes += data.nbytes
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        with self.lock:
+            pinned = set().union(*self.pins.values())
+            for clip_id, clip in list(self.resident.items()):
+                if self.resident_bytes <= self.budget_bytes:
+                    break
+                if clip_id in pinned:
+                    continue
+                #readers holding the old region keep it alive until they are done
+                self.resident_bytes -= clip["region"][1].nbytes
+                clip["region"] = None
+                del self.resident[clip_id]
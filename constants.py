@@ -1,3 +1,32 @@
 BASE_SAMPLE_RATE = 44100 
 BASE_CHANNELS = 2
 BASE_SAMPLE_WIDTH = 2  
+FULL_SCALE = 32768.0
+NUM_TRACKS = 5
+
+METER_FLOOR_DB = -60
+METER_REFRESH_MS = 33
+METER_DECAY_DB = 1.5
+METER_HOLD_MS = 1500
+METER_INTERVAL_BLOCKS = 6
+
+STEM_BLOCK_SECONDS = 10
+
+PLAYBACK_BLOCK_FRAMES = 1024
+LIMITER_LOOKAHEAD_MS = 1.5
+
+RECORDINGS_DIR = "recordings"
+RECORD_RING_SECONDS = 10
+RECORD_BUFFER_FRAMES = 256
+
+WAVEFORM_PEAK_FRAMES = 441
+WAVEFORM_REFRESH_MS = 100
+IMPORT_CHUNK_FRAMES = 65536
+
+MEMORY_BUDGET_MB = 1024
+PREFETCH_SECONDS = 30
+PREFETCH_START_SECONDS = 2
+PREFETCH_WAIT_SECONDS = 5
+
+METRONOME_CLICK_MS = 30
+METRONOME_VOLUME_DB = -6
@@ -0,0 +1,204 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+from constants import BASE_SAMPLE_RATE, BASE_CHANNELS, LIMITER_LOOKAHEAD_MS
+
+class Effect:
+    """Insert effect, process() works in place on a float32 (frames, channels) block at +-1.0 full scale."""
+    NAME = ""
+    #(name, from, to, resolution, default) for each slider in the insert editor
+    PARAMS = []
+
+    def __init__(self, **params):
+        self.latency = 0
+        for name, low, high, resolution, default in self.PARAMS:
+            setattr(self, name, params.get(name, default))
+        self.update()
+        self.reset()
+
+    def set_param(self, name, value):
+        setattr(self, name, float(value))
+        self.update()
+
+    def update(self):
+        """Recompute coefficients after a parameter change."""
+
+    def reset(self):
+        """Clear filter state before a new render."""
+
+    def process(self, block):
+        raise NotImplementedError
+
+class Delay(Effect):
+    """Plain delay line, used to line tracks up for plugin delay compensation."""
+    NAME = "Delay"
+
+    def __init__(self, frames):
+        super().__init__()
+        self.latency = frames
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros((self.latency, BASE_CHANNELS), dtype=np.float32)
+
+    def process(self, block):
+        if not self.latency:
+            return
+        delayed = np.concatenate((self.history, block))
+        self.history = delayed[len(block):]
+        block[:] = delayed[:len(block)]
+
+class BiquadEQ(Effect):
+    """RBJ cookbook peaking filter, run through lfilter with carried state."""
+    NAME = "EQ"
+    SHAPE = "peak"
+    PARAMS = [
+        ("frequency", 20, 20000, 10, 1000),
+        ("gain_db", -24, 24, 0.5, 0),
+        ("q", 0.1, 10, 0.1, 0.7),
+    ]
+
+    def update(self):
+        A = 10 ** (self.gain_db / 40)
+        w0 = 2 * np.pi * min(self.frequency, BASE_SAMPLE_RATE * 0.49) / BASE_SAMPLE_RATE
+        cos_w0 = np.cos(w0)
+        alpha = np.sin(w0) / (2 * max(self.q, 0.01))
+        shelf = 2 * np.sqrt(A) * alpha
+
+        if self.SHAPE == "lowshelf":
+            b = [A * ((A + 1) - (A - 1) * cos_w0 + shelf), 2 * A * ((A - 1) - (A + 1) * cos_w0), A * ((A + 1) - (A - 1) * cos_w0 - shelf)]
+            a = [(A + 1) + (A - 1) * cos_w0 + shelf, -2 * ((A - 1) + (A + 1) * cos_w0), (A + 1) + (A - 1) * cos_w0 - shelf]
+        elif self.SHAPE == "highshelf":
+            b = [A * ((A + 1) + (A - 1) * cos_w0 + shelf), -2 * A * ((A - 1) + (A + 1) * cos_w0), A * ((A + 1) + (A - 1) * cos_w0 - shelf)]
+            a = [(A + 1) - (A - 1) * cos_w0 + shelf, 2 * ((A - 1) - (A + 1) * cos_w0), (A + 1) - (A - 1) * cos_w0 - shelf]
+        else:
+            b = [1 + alpha * A, -2 * cos_w0, 1 - alpha * A]
+            a = [1 + alpha / A, -2 * cos_w0, 1 - alpha / A]
+
+        #swap both at once, the audio thread may be mid block
+        self.coefficients = (np.array(b, dtype=np.float32) / a[0], np.array(a, dtype=np.float32) / a[0])
+
+    def reset(self):
+        self.zi = np.zeros((2, BASE_CHANNELS), dtype=np.float32)
+
+    def process(self, block):
+        b, a = self.coefficients
+        block[:], self.zi = lfilter(b, a, block, axis=0, zi=self.zi)
+
+class LowShelfEQ(BiquadEQ):
+    NAME = "Low Shelf"
+    SHAPE = "lowshelf"
+    PARAMS = [
+        ("frequency", 20, 20000, 10, 200),
+        ("gain_db", -24, 24, 0.5, 0),
+        ("q", 0.1, 10, 0.1, 0.7),
+    ]
+
+class HighShelfEQ(BiquadEQ):
+    NAME = "High Shelf"
+    SHAPE = "highshelf"
+    PARAMS = [
+        ("frequency", 20, 20000, 10, 5000),
+        ("gain_db", -24, 24, 0.5, 0),
+        ("q", 0.1, 10, 0.1, 0.7),
+    ]
+
+def one_pole(time_ms):
+    #coefficient of a one-pole smoother with the given time constant
+    return float(np.exp(-1000 / (max(time_ms, 0.01) * BASE_SAMPLE_RATE)))
+
+class Compressor(Effect):
+    """Feed-forward RMS compressor.
+
+    The detector is a one-pole power average with the release time and the
+    gain curve is smoothed by a one-pole with the attack time, both as
+    lfilter calls with carried state instead of a per-sample loop.
+    """
+    NAME = "Compressor"
+    PARAMS = [
+        ("threshold_db", -60, 0, 0.5, -18),
+        ("ratio", 1, 20, 0.5, 4),
+        ("attack_ms", 0.1, 100, 0.1, 10),
+        ("release_ms", 10, 1000, 10, 100),
+        ("makeup_db", 0, 24, 0.5, 0),
+    ]
+
+    def update(self):
+        self.attack = one_pole(self.attack_ms)
+        self.release = one_pole(self.release_ms)
+
+    def reset(self):
+        self.detector_zi = np.zeros(1, dtype=np.float32)
+        self.gain_zi = np.zeros(1, dtype=np.float32)
+
+    def process(self, block):
+        power = np.mean(np.square(block), axis=1)
+        power, self.detector_zi = lfilter([1 - self.release], [1, -self.release], power, zi=self.detector_zi)
+
+        level_db = 10 * np.log10(np.maximum(power, 1e-12))
+        gain_db = np.minimum(self.threshold_db - level_db, 0) * (1 - 1 / max(self.ratio, 1))
+        gain_db, self.gain_zi = lfilter([1 - self.attack], [1, -self.attack], gain_db, zi=self.gain_zi)
+
+        block *= np.power(10, (gain_db + self.makeup_db) / 20, dtype=np.float32)[:, np.newaxis]
+
+class Limiter(Effect):
+    """Lookahead brickwall limiter.
+
+    The gain needed per sample is held for the lookahead window and then
+    averaged over it, so the gain has ramped down by the time the delayed
+    peak comes out. A release smoother lets the gain recover slowly.
+    """
+    NAME = "Limiter"
+    PARAMS = [
+        ("ceiling_db", -12, 0, 0.1, -0.3),
+        ("release_ms", 10, 1000, 10, 100),
+    ]
+
+    def __init__(self, **params):
+        self.lookahead = max(int(LIMITER_LOOKAHEAD_MS * BASE_SAMPLE_RATE / 1000), 2)
+        super().__init__(**params)
+        self.latency = self.lookahead
+
+    def update(self):
+        self.ceiling = 10 ** (self.ceiling_db / 20)
+        self.release = one_pole(self.release_ms)
+
+    def reset(self):
+        self.delay_history = np.zeros((self.lookahead, BASE_CHANNELS), dtype=np.float32)
+        self.gain_history = np.ones(self.lookahead, dtype=np.float32)
+        self.hold_history = np.ones(self.lookahead - 1, dtype=np.float32)
+        #release smoother starts settled at unity gain
+        self.release_zi = np.array([self.release], dtype=np.float32)
+
+    def process(self, block):
+        frames = len(block)
+        lookahead = self.lookahead
+
+        peak = np.max(np.abs(block), axis=1)
+        gain = np.minimum(1, self.ceiling / np.maximum(peak, 1e-12)).astype(np.float32)
+
+        gain = np.concatenate((self.gain_history, gain))
+        self.gain_history = gain[frames:]
+        hold = sliding_window_view(gain, lookahead + 1).min(axis=1)
+
+        hold = np.concatenate((self.hold_history, hold))
+        self.hold_history = hold[frames:]
+        ramp = sliding_window_view(hold, lookahead).mean(axis=1)
+
+        released, self.release_zi = lfilter([1 - self.release], [1, -self.release], ramp, zi=self.release_zi)
+        gain = np.minimum(ramp, released)
+
+        delayed = np.concatenate((self.delay_history, block))
+        self.delay_history = delayed[frames:]
+        np.multiply(delayed[:frames], gain[:, np.newaxis], out=block)
+        np.clip(block, -self.ceiling, self.ceiling, out=block)
+
+EFFECT_TYPES = {effect.NAME: effect for effect in (BiquadEQ, LowShelfEQ, HighShelfEQ, Compressor, Limiter)}
+
+def chain_latency(chain):
+    return sum(effect.latency for effect in chain)
+
+def process_chain(chain, block):
+    for effect in chain:
+        effect.process(block)
@@ -0,0 +1,288 @@
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import numpy as np
+
+from constants import BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH, FULL_SCALE, IMPORT_CHUNK_FRAMES
+from audio_config import PeakBuilder
+
+def read_pcm_header(file_path):
+    """Locate the sample data of an uncompressed WAV or AIFF file, or None if it needs a decoder."""
+    with open(file_path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12:
+            return None
+        if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+            return _read_wav_header(f, os.path.getsize(file_path))
+        if header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+            return _read_aiff_header(f, os.path.getsize(file_path), header[8:12] == b"AIFC")
+    return None
+
+def _read_wav_header(f, file_size):
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = struct.unpack("<4sI", chunk)
+        if chunk_id == b"fmt ":
+            data = f.read(size)
+            audio_format, channels, frame_rate, _, block_align, bits = struct.unpack("<HHIIHH", data[:16])
+            #extensible format keeps the real format code in the sub-format guid
+            if audio_format == 0xFFFE and len(data) >= 26:
+                audio_format = struct.unpack("<H", data[24:26])[0]
+            fmt = (audio_format, channels, frame_rate, block_align, bits)
+            if size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            audio_format, channels, frame_rate, block_align, bits = fmt
+            offset = f.tell()
+            #streamed files may leave the size unset
+            if size in (0, 0xFFFFFFFF) or offset + size > file_size:
+                size = file_size - offset
+            if audio_format == 1 and bits in (16, 24, 32):
+                dtype = f"<i{bits // 8}"
+            elif audio_format == 1 and bits == 8:
+                dtype = "u1"
+            elif audio_format == 3 and bits in (32, 64):
+                dtype = f"<f{bits // 8}"
+            else:
+                return None
+            return {
+                "offset": offset,
+                "frames": size // block_align,
+                "channels": channels,
+                "frame_rate": frame_rate,
+                "dtype": dtype,
+            }
+        else:
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+def _read_aiff_header(f, file_size, compressed):
+    comm = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = struct.unpack(">4sI", chunk)
+        if chunk_id == b"COMM":
+            data = f.read(size)
+            channels, frames, bits = struct.unpack(">hIh", data[:8])
+            frame_rate = _read_extended(data[8:18])
+            compression = data[18:22] if compressed else b"NONE"
+            comm = (channels, frames, bits, frame_rate, compression)
+            if size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"SSND":
+            if comm is None:
+                return None
+            channels, frames, bits, frame_rate, compression = comm
+            data_offset, _ = struct.unpack(">II", f.read(8))
+            offset = f.tell() + data_offset
+            if compression == b"NONE" and bits in (16, 24, 32):
+                dtype = f">i{bits // 8}"
+            elif compression == b"NONE" and bits == 8:
+                dtype = "i1"
+            elif compression == b"sowt" and bits == 16:
+                dtype = "<i2"
+            elif compression in (b"fl32", b"FL32"):
+                dtype = ">f4"
+            else:
+                return None
+            frames = min(frames, (file_size - offset) // (channels * (bits // 8)))
+            return {
+                "offset": offset,
+                "frames": frames,
+                "channels": channels,
+                "frame_rate": frame_rate,
+                "dtype": dtype,
+            }
+        else:
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+def _read_extended(data):
+    #80-bit IEEE extended float, only used for the AIFF sample rate
+    exponent = ((data[0] & 0x7F) << 8) | data[1]
+    mantissa = int.from_bytes(data[2:10], "big")
+    value = mantissa * 2.0 ** (exponent - 16383 - 63)
+    return int(round(-value if data[0] & 0x80 else value))
+
+def map_pcm_data(file_path, header):
+    """Memory map the sample data as a (frames, channels) array, 24-bit samples as raw byte triples."""
+    if header["frames"] <= 0:
+        return None
+    if header["dtype"].endswith("3"):
+        return np.memmap(
+            file_path, dtype=np.uint8, mode="r", offset=header["offset"],
+            shape=(header["frames"], header["channels"], 3)
+        )
+    return np.memmap(
+        file_path, dtype=np.dtype(header["dtype"]), mode="r", offset=header["offset"],
+        shape=(header["frames"], header["channels"])
+    )
+
+def to_float(samples, dtype):
+    if dtype.endswith("3"):
+        #assemble 24-bit triples into int32, shifting up so the sign comes along
+        b = samples.astype(np.int32)
+        if dtype.startswith("<"):
+            value = (b[..., 0] << 8) | (b[..., 1] << 16) | (b[..., 2] << 24)
+        else:
+            value = (b[..., 2] << 8) | (b[..., 1] << 16) | (b[..., 0] << 24)
+        return value.astype(np.float32) / 2 ** 31
+    kind = np.dtype(dtype)
+    if kind.kind == "f":
+        return samples.astype(np.float32)
+    if kind.kind == "u":
+        return (samples.astype(np.float32) - 128) / 128
+    return samples.astype(np.float32) / 2 ** (kind.itemsize * 8 - 1)
+
+class Resampler:
+    """Linear interpolation resampler that carries its position across chunks."""
+
+    def __init__(self, source_rate, target_rate):
+        self.step = source_rate / target_rate
+        self.position = 0.0
+        self.previous = None
+
+    def process(self, chunk):
+        data = chunk if self.previous is None else np.concatenate((self.previous, chunk))
+        last = len(data) - 1
+        if last <= self.position:
+            self.previous = data[-1:]
+            self.position -= last
+            return data[:0]
+
+        count = int(np.ceil((last - self.position) / self.step))
+        t = self.position + np.arange(count) * self.step
+        index = t.astype(np.int64)
+        frac = (t - index).astype(np.float32)[:, np.newaxis]
+        out = data[index] * (1 - frac) + data[index + 1] * frac
+
+        self.position = self.position + count * self.step - last
+        self.previous = data[-1:]
+        return out
+
+class ClipImporter:
+    """Decode a file in chunks into a raw base format PCM store, collecting waveform peaks as it goes.
+
+    WAV and AIFF sample data is memory mapped and converted chunk by chunk,
+    anything else is decoded by ffmpeg straight to the base format through
+    a pipe. Only one chunk is ever held in memory.
+    """
+
+    def __init__(self, file_path, store_path):
+        self.file_path = file_path
+        self.store_path = store_path
+        self.peak_builder = PeakBuilder()
+        self.peaks = self.peak_builder.peaks
+        self.frames_written = 0
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.thread:
+            self.thread.join()
+
+    def load(self):
+        """Map the finished store, clips keep their samples on disk and page them in on demand."""
+        if not self.frames_written:
+            return None
+        return np.memmap(self.store_path, dtype=np.uint8, mode="r")
+
+    def _run(self):
+        try:
+            with open(self.store_path, "wb") as store:
+                for chunk in self._decode():
+                    if self.cancelled:
+                        break
+                    store.write(chunk.tobytes())
+                    self.peak_builder.add(chunk)
+                    self.frames_written += len(chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+
+    def _decode(self):
+        header = read_pcm_header(self.file_path)
+        if header:
+            yield from self._read_pcm(header)
+        else:
+            yield from self._read_decoder_pipe()
+
+    def _read_pcm(self, header):
+        samples = map_pcm_data(self.file_path, header)
+        if samples is None:
+            return
+        dtype = header["dtype"]
+        channels = header["channels"]
+        resampler = None
+        if header["frame_rate"] != BASE_SAMPLE_RATE:
+            resampler = Resampler(header["frame_rate"], BASE_SAMPLE_RATE)
+        #already in the base format, copy chunks straight through
+        passthrough = dtype == "<i2" and channels == BASE_CHANNELS and resampler is None
+
+        for start in range(0, len(samples), IMPORT_CHUNK_FRAMES):
+            chunk = samples[start:start + IMPORT_CHUNK_FRAMES]
+            if passthrough:
+                yield np.ascontiguousarray(chunk)
+                continue
+
+            chunk = to_float(chunk, dtype)
+            if channels == 1:
+                chunk = np.repeat(chunk, BASE_CHANNELS, axis=1)
+            elif channels > BASE_CHANNELS:
+                chunk = chunk[:, :BASE_CHANNELS]
+            if resampler:
+                chunk = resampler.process(chunk)
+            yield np.clip(chunk * FULL_SCALE, -32768, 32767).astype(np.int16)
+
+    def _read_decoder_pipe(self):
+        from pydub import AudioSegment
+
+        command = [
+            AudioSegment.converter, "-v", "error", "-i", self.file_path,
+            "-f", "s16le", "-acodec", "pcm_s16le",
+            "-ac", str(BASE_CHANNELS), "-ar", str(BASE_SAMPLE_RATE), "-"
+        ]
+        #stderr goes to a file, a full pipe of decode errors would block ffmpeg and the read below forever
+        error_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=error_file)
+        frame_bytes = BASE_CHANNELS * BASE_SAMPLE_WIDTH
+        leftover = b""
+        try:
+            while not self.cancelled:
+                data = process.stdout.read(IMPORT_CHUNK_FRAMES * frame_bytes)
+                if not data:
+                    break
+                data = leftover + data
+                usable = len(data) - len(data) % frame_bytes
+                leftover = data[usable:]
+                if usable:
+                    yield np.frombuffer(data[:usable], dtype=np.int16).reshape(-1, BASE_CHANNELS)
+            if self.cancelled:
+                process.kill()
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            error_file.seek(0)
+            #a damaged file can log an error per frame, the last few lines are enough
+            errors = "\n".join(error_file.read().decode(errors="replace").strip().splitlines()[-5:])
+            error_file.close()
+        if returncode and not self.cancelled:
+            raise RuntimeError(errors or f"decoder exited with code {returncode}")
@@ -1,7 +1,19 @@
+import time
+start = time.perf_counter()
+
+import logging
 import tkinter as tk
 from DAW import DAWApp
 
+logger = logging.getLogger("DAW")
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    logger.info("startup: imports %.1f ms", (time.perf_counter() - start) * 1000)
+
+    phase_start = time.perf_counter()
     root = tk.Tk()
     app = DAWApp(root)
+    logger.info("startup: build window %.1f ms", (time.perf_counter() - phase_start) * 1000)
+
     root.mainloop()
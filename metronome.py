@@ -0,0 +1,63 @@
+import numpy as np
+
+from constants import (
+    BASE_SAMPLE_RATE, BASE_CHANNELS,
+    METRONOME_CLICK_MS, METRONOME_VOLUME_DB
+)
+from audio_config import add_source
+
+#frequency and level of the accented downbeat, the other beats and the subdivisions
+CLICK_SOUNDS = [(1500, 1.0), (1000, 0.7), (800, 0.4)]
+
+class Metronome:
+    """Click track on the beat grid.
+
+    The three click sounds are rendered once. Ticks fall on whole multiples of
+    the tick length, so each block works out which ticks overlap it and their
+    kinds arithmetically and adds the pre-rendered samples, at any distance
+    from the start and with no schedule to rebuild on tempo changes.
+    """
+
+    def __init__(self):
+        self.volume_db = METRONOME_VOLUME_DB
+        self.clicks = self.render_clicks()
+        self.click_frames = max(len(click) for click in self.clicks)
+        self.tempo = None
+
+    def render_clicks(self):
+        frames = int(METRONOME_CLICK_MS * BASE_SAMPLE_RATE / 1000)
+        t = np.arange(frames) / BASE_SAMPLE_RATE
+        envelope = np.exp(-t * 5000 / METRONOME_CLICK_MS)
+        volume = 10 ** (self.volume_db / 20)
+        clicks = []
+        for frequency, level in CLICK_SOUNDS:
+            click = np.sin(2 * np.pi * frequency * t) * envelope * level * volume
+            clicks.append(np.repeat(click[:, np.newaxis], BASE_CHANNELS, axis=1).astype(np.float32))
+        return clicks
+
+    def set_tempo(self, bpm, beats_per_bar, subdivision):
+        #only the tick length depends on tempo, the click samples are kept
+        self.tempo = (60 / bpm / subdivision * BASE_SAMPLE_RATE, beats_per_bar, subdivision)
+
+    def render(self, block, block_start):
+        """Add the clicks that overlap the block."""
+        tempo = self.tempo
+        if tempo is None:
+            return
+        tick_frames, beats_per_bar, subdivision = tempo
+
+        #ticks starting after block_start - click_frames and before the block end, tick 0 is at frame 0
+        first = max(int((block_start - self.click_frames) // tick_frames), 0)
+        last = int((block_start + len(block)) // tick_frames) + 2
+        ticks = np.arange(first, last)
+        frames = np.round(ticks * tick_frames).astype(np.int64)
+        overlapping = (frames > block_start - self.click_frames) & (frames < block_start + len(block))
+
+        for tick, frame in zip(ticks[overlapping], frames[overlapping]):
+            if tick % (subdivision * beats_per_bar) == 0:
+                kind = 0
+            elif tick % subdivision == 0:
+                kind = 1
+            else:
+                kind = 2
+            add_source(block, block_start, frame, self.clicks[kind])
@@ -0,0 +1,117 @@
+import numpy as np
+
+from constants import BASE_SAMPLE_RATE, BASE_CHANNELS, NUM_TRACKS, FULL_SCALE
+from effects import Delay, chain_latency, process_chain
+from audio_config import add_source
+
+def prepare_clip_sources(audio_clips):
+    #clip data is already stored in the base format
+    sources = []
+    for clip in audio_clips:
+        start_frame = int(round(clip["start_time_seconds"] * BASE_SAMPLE_RATE))
+        sources.append((clip["track"] - 1, start_frame, clip))
+    return sources
+
+def clip_frames(clip, begin, end):
+    #looked up per block, the resident region from the clip cache when it covers the block, else the disk store
+    frames = np.frombuffer(clip["raw_data"], dtype=np.int16).reshape(-1, BASE_CHANNELS)
+    begin, end = max(begin, 0), min(end, len(frames))
+    region = clip.get("region")
+    if region is not None and region[0] <= begin and end <= region[0] + len(region[1]):
+        return region
+    return 0, frames
+
+class Mixer:
+    """Block mixer: sums clips per track, runs track inserts, sums to master and runs master inserts.
+
+    Blocks are float32 at +-1.0 full scale. Tracks with shorter insert chains
+    are delayed to match the longest one, so `latency` is the delay of the
+    whole render. With `track` set only that track is rendered, on a single
+    bus that doubles as the master, which is what stems need.
+    """
+
+    def __init__(self, audio_clips, track_gains=None, track_mutes=None, track_effects=None, master_effects=None,
+                 block_frames=1024, metronome=None, track=None):
+        track_indices = [track - 1] if track else list(range(NUM_TRACKS))
+        self.sources = [
+            (track_indices.index(track_index), start_frame, clip)
+            for track_index, start_frame, clip in prepare_clip_sources(audio_clips)
+            if track_index in track_indices
+        ]
+        if track:
+            self.buses = np.zeros((1, block_frames, BASE_CHANNELS), dtype=np.float32)
+            self.tracks = self.buses
+            self.master = self.buses[0]
+        else:
+            #tracks and master share one buffer so the meters reduce them in one pass
+            self.buses = np.zeros((NUM_TRACKS + 1, block_frames, BASE_CHANNELS), dtype=np.float32)
+            self.tracks = self.buses[:NUM_TRACKS]
+            self.master = self.buses[NUM_TRACKS]
+        self.block_frames = block_frames
+        self.metronome = metronome
+
+        #int16 to float conversion folded into the track gain
+        self.track_factors = np.full((len(track_indices), 1, 1), 1 / FULL_SCALE, dtype=np.float32)
+        for bus, track_index in enumerate(track_indices):
+            if track_mutes and track_mutes[track_index]:
+                self.track_factors[bus] = 0
+            elif track_gains:
+                self.track_factors[bus] *= 10 ** (track_gains[track_index] / 20)
+
+        #chains are fixed for the render, parameters stay live
+        self.track_effects = [list(track_effects[index]) if track_effects else [] for index in track_indices]
+        self.master_effects = list(master_effects or [])
+
+        track_latencies = [chain_latency(chain) for chain in self.track_effects]
+        track_latency = max(track_latencies)
+        for chain, latency in zip(self.track_effects, track_latencies):
+            if latency < track_latency:
+                chain.append(Delay(track_latency - latency))
+        self.latency = track_latency + chain_latency(self.master_effects)
+
+    def reset(self):
+        for chain in self.track_effects + [self.master_effects]:
+            for effect in chain:
+                effect.reset()
+
+    def render(self, block_start, num_frames, volume_db=0):
+        """Render num_frames starting at timeline frame block_start, returns a view into the master buffer."""
+        tracks = self.tracks[:, :num_frames]
+        tracks.fill(0)
+        for track_index, start_frame, clip in self.sources:
+            offset, frames = clip_frames(clip, block_start - start_frame, block_start + num_frames - start_frame)
+            add_source(tracks[track_index], block_start, start_frame + offset, frames)
+        tracks *= self.track_factors
+
+        for track_index, chain in enumerate(self.track_effects):
+            process_chain(chain, tracks[track_index])
+
+        master = self.master[:num_frames]
+        if len(tracks) > 1:
+            np.sum(tracks, axis=0, out=master)
+        process_chain(self.master_effects, master)
+        #the click skips the inserts, shifted by their latency so it stays on the beat,
+        #but goes through the master volume so it keeps its level against the program
+        if self.metronome:
+            self.metronome.render(master, block_start - self.latency)
+        if volume_db:
+            master *= 10 ** (volume_db / 20)
+        return master
+
+    def render_pcm(self, start_frame, num_frames, volume_db=0):
+        """Yield int16 bytes for an offline render, with the mixer latency trimmed off the front."""
+        skip = self.latency
+        position = start_frame
+        end_frame = start_frame + num_frames + self.latency
+        while position < end_frame:
+            frames_in_block = min(self.block_frames, end_frame - position)
+            block = self.render(position, frames_in_block, volume_db)
+            position += frames_in_block
+            if skip >= frames_in_block:
+                skip -= frames_in_block
+                continue
+            yield to_pcm(block[skip:])
+            skip = 0
+
+def to_pcm(block):
+    return np.clip(block * FULL_SCALE, -32768, 32767).astype(np.int16).tobytes()
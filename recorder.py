@@ -0,0 +1,122 @@
+import threading
+import wave
+import logging
+import numpy as np
+
+from constants import (
+    BASE_SAMPLE_RATE, BASE_CHANNELS, BASE_SAMPLE_WIDTH,
+    RECORD_RING_SECONDS, RECORD_BUFFER_FRAMES
+)
+from audio_config import PeakBuilder
+
+logger = logging.getLogger("DAW")
+
+class Recorder:
+    """Capture from the default input device and stream the take to a WAV file."""
+
+    def __init__(self, pyaudio_instance, file_path):
+        self.pyaudio_instance = pyaudio_instance
+        self.file_path = file_path
+        self.stream = None
+        self.writer_thread = None
+        self.stopping = False
+
+        #the callback only copies into the ring, the writer thread drains it to disk
+        self.ring = np.zeros((RECORD_RING_SECONDS * BASE_SAMPLE_RATE, BASE_CHANNELS), dtype=np.int16)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0
+        self.data_ready = threading.Event()
+
+        #appended by the writer for the live waveform
+        self.peak_builder = PeakBuilder()
+        self.peaks = self.peak_builder.peaks
+
+        self.input_latency = 0
+        self.first_frame_time = None
+
+    def start(self):
+        import pyaudio
+        self.paContinue = pyaudio.paContinue
+
+        device_info = self.pyaudio_instance.get_default_input_device_info()
+        channels = min(int(device_info["maxInputChannels"]), BASE_CHANNELS)
+        self.input_channels = channels
+
+        self.writer_thread = threading.Thread(target=self._write_take, daemon=True)
+        self.writer_thread.start()
+
+        self.stream = self.pyaudio_instance.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=BASE_SAMPLE_RATE,
+            input=True,
+            frames_per_buffer=RECORD_BUFFER_FRAMES,
+            stream_callback=self._capture
+        )
+        self.input_latency = self.stream.get_input_latency()
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.stopping = True
+        self.data_ready.set()
+        if self.writer_thread:
+            self.writer_thread.join()
+        if self.overruns:
+            logger.warning("recording: dropped %d frames, disk writer fell behind", self.overruns)
+
+    def capture_start_time(self):
+        """Stream clock time at which the first recorded frame reached the input."""
+        return self.first_frame_time
+
+    def _capture(self, in_data, frame_count, time_info, status):
+        if self.first_frame_time is None:
+            #some host apis leave the adc time at 0, estimate it from the callback time
+            adc_time = time_info["input_buffer_adc_time"]
+            if not adc_time:
+                adc_time = time_info["current_time"] - frame_count / BASE_SAMPLE_RATE - self.input_latency
+            self.first_frame_time = adc_time
+
+        frames = np.frombuffer(in_data, dtype=np.int16).reshape(-1, self.input_channels)
+        count = len(frames)
+        size = len(self.ring)
+        if self.write_pos - self.read_pos + count > size:
+            self.overruns += count
+            return (None, self.paContinue)
+
+        #mono inputs broadcast across both channels
+        start = self.write_pos % size
+        first = min(count, size - start)
+        self.ring[start:start + first] = frames[:first]
+        if first < count:
+            self.ring[:count - first] = frames[first:]
+
+        self.write_pos += count
+        self.data_ready.set()
+        return (None, self.paContinue)
+
+    def _write_take(self):
+        with wave.open(self.file_path, "wb") as wav_file:
+            wav_file.setnchannels(BASE_CHANNELS)
+            wav_file.setsampwidth(BASE_SAMPLE_WIDTH)
+            wav_file.setframerate(BASE_SAMPLE_RATE)
+
+            while True:
+                self.data_ready.wait(timeout=0.1)
+                self.data_ready.clear()
+                stopping = self.stopping
+
+                size = len(self.ring)
+                while self.read_pos < self.write_pos:
+                    start = self.read_pos % size
+                    count = min(self.write_pos - self.read_pos, size - start)
+                    segment = self.ring[start:start + count]
+                    wav_file.writeframes(segment.tobytes())
+                    self.peak_builder.add(segment)
+                    self.read_pos += count
+
+                if stopping:
+                    break
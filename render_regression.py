@@ -0,0 +1,262 @@
+"""Render regression harness.
+
+Builds seeded random arrangements (clip layout, source formats, track gains,
+inserts, master volume), renders them through the offline mixer or the
+arrangement export and compares the result with render_goldens.json. Lengths
+must match the stored frame counts, integer-only cases must be bit identical,
+cases with inserts are compared by band energies within SPECTRUM_TOLERANCE_DB
+and clipping cases must still reach full scale. Render
+time is reported for every case, along with the cost of the level meters per
+playback block, which fails the run above METER_MAX_SHARE of the block render.
+
+    python render_regression.py            check against the goldens
+    python render_regression.py --update   rewrite the goldens after an intended change
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+from audio_config import measure_levels, mix_audio_clips, render_mix
+from constants import (
+    BASE_SAMPLE_RATE, BASE_CHANNELS, NUM_TRACKS, STEM_BLOCK_SECONDS, PLAYBACK_BLOCK_FRAMES, METER_INTERVAL_BLOCKS
+)
+from GUI_config import snap_to_grid
+from importer import ClipImporter
+from mixer import Mixer, to_pcm
+
+GOLDENS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_goldens.json")
+SPECTRUM_BANDS = 24
+SPECTRUM_TOLERANCE_DB = 0.1
+PIXELS_PER_SECOND = 100
+METERING_CASE = "dense_overlap"
+METER_MAX_SHARE = 0.05
+METERING_RUNS = 5
+
+#(bits, channels, frame rate) of the generated source files
+SOURCE_FORMATS = [(16, 2, 44100), (16, 1, 44100), (8, 1, 22050), (24, 2, 48000), (32, 1, 96000)]
+
+CASES = [
+    {"name": "single_clip", "seed": 1, "clips": 1},
+    {"name": "dense_overlap", "seed": 2, "clips": 12},
+    {"name": "mixed_formats", "seed": 3, "clips": 8, "formats": True},
+    {"name": "track_gains", "seed": 4, "clips": 10, "gains": True},
+    {"name": "inserts", "seed": 5, "clips": 6, "gains": True, "effects": True},
+    {"name": "master_clipping", "seed": 6, "clips": 8, "volume_db": 12, "clipping": True},
+    {"name": "export_mix", "seed": 7, "clips": 6, "gains": True, "export": True},
+]
+
+#without pydub the export case renders through render_mix, the same bytes mix_audio_clips wraps
+PYDUB_AVAILABLE = importlib.util.find_spec("pydub") is not None
+
+def write_source(path, rng, bits, channels, frame_rate, seconds):
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    tone = np.sin(2 * np.pi * rng.uniform(80, 2000) * t) * rng.uniform(0.2, 0.8)
+    noise = rng.standard_normal((len(t), channels)) * 0.05
+    samples = np.clip(tone[:, np.newaxis] + noise, -1, 1)
+
+    if bits == 8:
+        data = (samples * 127 + 128).astype(np.uint8).tobytes()
+    elif bits == 16:
+        data = (samples * 32767).astype("<i2").tobytes()
+    elif bits == 24:
+        value = (samples * (2 ** 23 - 1)).astype(np.int32)
+        data = np.stack([value & 255, (value >> 8) & 255, (value >> 16) & 255], axis=-1).astype(np.uint8).tobytes()
+    else:
+        data = (samples * (2 ** 31 - 1)).astype("<i4").tobytes()
+
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(bits // 8)
+        wav_file.setframerate(frame_rate)
+        wav_file.writeframes(data)
+
+def import_source(path, store_path):
+    importer = ClipImporter(path, store_path)
+    importer.start()
+    importer.thread.join()
+    if importer.error:
+        raise importer.error
+    with open(store_path, "rb") as store:
+        return store.read()
+
+def build_arrangement(case, work_dir):
+    rng = np.random.default_rng(case["seed"])
+    bpm = int(rng.integers(60, 241))
+    subdivision = int(rng.choice([1, 2, 3, 4]))
+    pixels_per_beat = PIXELS_PER_SECOND * 60 / bpm
+
+    clips = []
+    for index in range(case["clips"]):
+        bits, channels, frame_rate = SOURCE_FORMATS[rng.integers(len(SOURCE_FORMATS))] if case.get("formats") else SOURCE_FORMATS[0]
+        source_path = os.path.join(work_dir, f"{case['name']}_{index}.wav")
+        write_source(source_path, rng, bits, channels, frame_rate, rng.uniform(0.2, 3))
+        raw_data = import_source(source_path, source_path + ".pcm")
+
+        x, track = snap_to_grid(rng.uniform(0, 800), rng.uniform(0, 500), pixels_per_beat, subdivision)
+        clips.append({
+            "raw_data": raw_data,
+            "start_time_seconds": x / PIXELS_PER_SECOND,
+            "track": track,
+            "duration_seconds": len(raw_data) / (BASE_SAMPLE_RATE * BASE_CHANNELS * 2),
+        })
+
+    track_gains = [0] * NUM_TRACKS
+    track_mutes = [False] * NUM_TRACKS
+    if case.get("gains"):
+        track_gains = [int(gain) for gain in rng.integers(-12, 7, NUM_TRACKS)]
+        track_mutes = [bool(mute) for mute in rng.random(NUM_TRACKS) < 0.15]
+
+    track_effects = None
+    master_effects = None
+    if case.get("effects"):
+        from effects import BiquadEQ, LowShelfEQ, Compressor, Limiter
+        track_effects = [[] for _ in range(NUM_TRACKS)]
+        track_effects[0] = [BiquadEQ(frequency=2000, gain_db=6), Compressor(threshold_db=-24, ratio=4)]
+        track_effects[1] = [LowShelfEQ(gain_db=-6)]
+        master_effects = [Limiter(ceiling_db=-1)]
+
+    return clips, track_gains, track_mutes, track_effects, master_effects
+
+def arrangement_span(clips):
+    #same span as export_audio, earliest clip start to latest clip end
+    start_frame = min(int(round(clip["start_time_seconds"] * BASE_SAMPLE_RATE)) for clip in clips)
+    end_frame = max(int(round((clip["start_time_seconds"] + clip["duration_seconds"]) * BASE_SAMPLE_RATE)) for clip in clips)
+    return start_frame, end_frame
+
+def render_case(case, work_dir):
+    clips, track_gains, track_mutes, track_effects, master_effects = build_arrangement(case, work_dir)
+    if case.get("export"):
+        #export_audio's path, from frame 0 to the end of the last clip
+        _, end_frame = arrangement_span(clips)
+        total_duration_ms = end_frame * 1000 / BASE_SAMPLE_RATE
+        mix = mix_audio_clips if PYDUB_AVAILABLE else render_mix
+        start = time.perf_counter()
+        data = mix(clips, total_duration_ms, track_gains, track_mutes, track_effects, master_effects)
+        render_ms = (time.perf_counter() - start) * 1000
+        return (data.raw_data if PYDUB_AVAILABLE else data), render_ms
+
+    mixer = Mixer(
+        clips, track_gains, track_mutes, track_effects, master_effects,
+        block_frames=STEM_BLOCK_SECONDS * BASE_SAMPLE_RATE
+    )
+    start_frame, end_frame = arrangement_span(clips)
+
+    start = time.perf_counter()
+    data = b"".join(mixer.render_pcm(start_frame, end_frame - start_frame, case.get("volume_db", 0)))
+    render_ms = (time.perf_counter() - start) * 1000
+    return data, render_ms
+
+def time_metering(case, work_dir):
+    #playback path block by block, render and to_pcm against the meters, best of METERING_RUNS
+    clips, track_gains, track_mutes, _, _ = build_arrangement(case, work_dir)
+    mixer = Mixer(clips, track_gains, track_mutes, block_frames=PLAYBACK_BLOCK_FRAMES)
+    scratch = np.empty((NUM_TRACKS + 1, PLAYBACK_BLOCK_FRAMES * BASE_CHANNELS), dtype=np.float32)
+    start_frame, end_frame = arrangement_span(clips)
+    blocks = -(-(end_frame - start_frame) // PLAYBACK_BLOCK_FRAMES)
+
+    render_times, meter_times = [], []
+    for _ in range(METERING_RUNS):
+        render_time = meter_time = 0
+        for block, block_start in enumerate(range(start_frame, end_frame, PLAYBACK_BLOCK_FRAMES)):
+            frames = min(PLAYBACK_BLOCK_FRAMES, end_frame - block_start)
+            start = time.perf_counter()
+            to_pcm(mixer.render(block_start, frames))
+            render_time += time.perf_counter() - start
+            if block % METER_INTERVAL_BLOCKS == 0:
+                start = time.perf_counter()
+                measure_levels(mixer.buses[:, :frames], scratch)
+                meter_time += time.perf_counter() - start
+        render_times.append(render_time)
+        meter_times.append(meter_time)
+
+    return min(render_times) * 1e6 / blocks, min(meter_times) * 1e6 / blocks
+
+def band_energies(data):
+    #energy of the mono sum in log spaced bands, in dB
+    samples = np.frombuffer(data, dtype=np.int16).reshape(-1, BASE_CHANNELS).astype(np.float64).mean(axis=1)
+    power = np.abs(np.fft.rfft(samples)) ** 2
+    freqs = np.fft.rfftfreq(len(samples), 1 / BASE_SAMPLE_RATE)
+    edges = np.geomspace(20, 20000, SPECTRUM_BANDS + 1)
+    energies = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        band = power[(freqs >= low) & (freqs < high)]
+        energies.append(round(float(10 * np.log10(band.sum() + 1e-12)), 3))
+    return energies
+
+def clipped_samples(data):
+    samples = np.frombuffer(data, dtype=np.int16)
+    return int(np.count_nonzero((samples == 32767) | (samples == -32768)))
+
+def check_case(case, golden, data):
+    if golden is None:
+        return False, "no golden"
+    frames = len(data) // (BASE_CHANNELS * 2)
+    if frames != golden["frames"]:
+        return False, f"length differs, golden has {golden['frames']} frames"
+    #a clipping case that stops clipping no longer covers the to_pcm limits
+    if case.get("clipping") and not clipped_samples(data):
+        return False, "no samples at full scale"
+    if case.get("effects"):
+        diff = np.max(np.abs(np.array(band_energies(data)) - np.array(golden["bands"])))
+        if diff > SPECTRUM_TOLERANCE_DB:
+            return False, f"spectrum differs by {diff:.3f} dB"
+        return True, f"spectrum within {diff:.3f} dB"
+    if hashlib.sha256(data).hexdigest() != golden["sha256"]:
+        return False, "checksum differs"
+    return True, "bit identical"
+
+def main():
+    parser = argparse.ArgumentParser(description="Render regression harness")
+    parser.add_argument("--update", action="store_true", help="rewrite the goldens from the current renders")
+    args = parser.parse_args()
+
+    goldens = {}
+    if os.path.exists(GOLDENS_PATH):
+        with open(GOLDENS_PATH) as f:
+            goldens = json.load(f)
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="daw_regression_") as work_dir:
+        for case in CASES:
+            data, render_ms = render_case(case, work_dir)
+            frames = len(data) // (BASE_CHANNELS * 2)
+            if args.update:
+                goldens[case["name"]] = {
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "bands": band_energies(data),
+                    "frames": frames,
+                }
+                ok, message = True, "updated"
+            else:
+                ok, message = check_case(case, goldens.get(case["name"]), data)
+            if case.get("clipping"):
+                message += f", {clipped_samples(data)} samples clipped"
+            if case.get("export") and not PYDUB_AVAILABLE:
+                message += ", via render_mix (pydub not installed)"
+            failures += not ok
+            print(f"{case['name']:<16} {'ok' if ok else 'FAIL':<5} {render_ms:8.1f} ms  {frames:>8} frames  {message}")
+
+        render_us, meter_us = time_metering(next(case for case in CASES if case["name"] == METERING_CASE), work_dir)
+        ok = meter_us / render_us <= METER_MAX_SHARE
+        failures += not ok
+        print(
+            f"{'metering':<16} {'ok' if ok else 'FAIL':<5} {meter_us:8.1f} us per block, "
+            f"{meter_us / render_us:.1%} of {render_us:.1f} us render (limit {METER_MAX_SHARE:.0%})"
+        )
+
+    if args.update:
+        with open(GOLDENS_PATH, "w") as f:
+            json.dump(goldens, f, indent=2)
+            f.write("\n")
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())